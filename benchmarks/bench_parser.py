@@ -0,0 +1,44 @@
+"""
+Benchmarks parsing multi-megabyte responses with many <write> and <replace> tags,
+both as a single string and fed in small chunks, as when streaming.
+
+The time per MB should stay (roughly) flat as the response grows, i.e. parsing is linear.
+
+Usage:
+python benchmarks/bench_parser.py
+"""
+
+import time
+
+from strange_loop_agent.parser import parse_writes, WriteParser
+
+def response(n_writes, lines_per_write=200):
+    body = '\n'.join(f'    x_{j} = f(x_{j-1}) if x < {j} else None' for j in range(lines_per_write))
+    parts = []
+    for i in range(n_writes):
+        parts.append(f'Now file {i}, where a < b.\n<write path="generated/file_{i}.py">\ndef f_{i}(x):\n{body}\n</write>\n')
+        parts.append(f'<replace path="generated/file_{i}.py#f_{i}">\n<pattern>x_1 =</pattern>\n<replacement>y_1 =</replacement>\n</replace>\n')
+    return ''.join(parts)
+
+def bench(n_writes, chunk_size=64, repeats=3):
+    text = response(n_writes)
+    best_whole = float('inf')
+    best_chunks = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        parse_writes(text)
+        best_whole = min(best_whole, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        parser = WriteParser()
+        for i in range(0, len(text), chunk_size):
+            parser.feed(text[i:i+chunk_size])
+        parser.close()
+        best_chunks = min(best_chunks, time.perf_counter() - start)
+    return len(text) / 1e6, best_whole, best_chunks
+
+if __name__ == "__main__":
+    print(f"{'MB':>8} {'whole s':>10} {'chunks s':>10} {'chunks s/MB':>12}")
+    for n_writes in [40, 80, 160, 320, 640]:
+        mb, whole, chunks = bench(n_writes)
+        print(f"{mb:>8.2f} {whole:>10.4f} {chunks:>10.4f} {chunks/mb:>12.4f}")
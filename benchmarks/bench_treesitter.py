@@ -0,0 +1,49 @@
+"""
+Benchmarks parsing files with thousands of methods, like generated protobuf stubs.
+
+The time per definition should stay (roughly) flat as the file grows, i.e. parsing is linear.
+Parses are built lazily, so we time finding every definition, as well as just the top-level ones.
+
+Usage:
+python benchmarks/bench_treesitter.py
+"""
+
+import time
+
+from strange_loop_agent.treesitter import treesitter_parse
+
+def protobuf_stub(n_classes, methods_per_class=20):
+    lines = ['from google.protobuf import message as _message', '']
+    for i in range(n_classes):
+        lines.append(f'class Message{i}(_message.Message):')
+        lines.append(f'    class Nested{i}(_message.Message):')
+        lines.append(f'        def ByteSize(self) -> int: ...')
+        for j in range(methods_per_class):
+            lines.append(f'    def field_{j}(self, value: int = 0) -> None:')
+            lines.append(f'        self._field_{j} = value')
+        lines.append('')
+    return '\n'.join(lines)
+
+def count_definitions(ast):
+    return sum(bool(child.signature) + count_definitions(child) for child in ast.children.values())
+
+def bench(n_classes, repeats=3):
+    code = protobuf_stub(n_classes)
+    best_top = float('inf')
+    best_all = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        ast = treesitter_parse(code)
+        ast.summarize(1)
+        best_top = min(best_top, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        n_defs = count_definitions(treesitter_parse(code))
+        best_all = min(best_all, time.perf_counter() - start)
+    return n_defs, best_top, best_all
+
+if __name__ == "__main__":
+    print(f"{'definitions':>12} {'top-level s':>12} {'all s':>10} {'us/definition':>14}")
+    for n_classes in [50, 100, 200, 400, 800]:
+        n_defs, top, seconds = bench(n_classes)
+        print(f"{n_defs:>12} {top:>12.4f} {seconds:>10.4f} {1e6*seconds/n_defs:>14.2f}")
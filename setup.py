@@ -8,7 +8,7 @@ setup(
     install_requires=[
         "openai",
         "anthropic",
-        "pathspec",
+        "pathspec>=0.12",
         "tree-sitter==0.21.3",
         "tree-sitter-languages==1.10.2"
     ],
@@ -4,8 +4,10 @@ import hashlib
 from pathlib import Path
 from typing import Dict, List
 
-from .treesitter import treesitter_ast, TreeSitterAST
+from .treesitter import treesitter_parse, treesitter_ast_edit, language_for_path, TreeSitterAST
 from .exceptions import AgentException
+from .cache import LRUCache
+from .ignore import Ignore
 
 """
 Valid Path must exist, and we must have read access.
@@ -18,23 +20,67 @@ A valid FullPath is the same, but it could also be a part of a UTF-8 encoded tex
 There are several slow operations, including doing a treesitter parse
 of a file, and checking whether it is binary.  We cache these, using
 the file path, modification time and size as a key.
+
+These in-memory caches are backed by an optional persistent cache (see cache.py),
+so that parses survive between sessions.
 """
 
 def file_key(path):
-    return (str(path), path.stat().st_mtime, path.stat().st_size)
+    stat = path.stat()
+    return (str(path), stat.st_mtime, stat.st_size)
+
+def key_path(key):
+    return key[0]
+
+#Budgets for the in-memory caches.
+treesitter_cache_max_bytes = 512 * 2**20
+cache_is_utf8_max_entries = 100000
+
+#### Persistent cache, set up by initialize_state.
+persistent_cache = None
+def set_persistent_cache(cache):
+    global persistent_cache
+    persistent_cache = cache
 
 #### Cache doing the treesitter parsing.
-treesitter_cache = {}
+treesitter_cache = LRUCache(treesitter_cache_max_bytes, sizeof=lambda ast: ast.nbytes(), group=key_path)
 def treesitter_file_ast(path):
     assert is_utf8(path)
 
     key = file_key(path)
-    if key not in treesitter_cache:
-        #with path.open('r') as file:
-        #    contents = file.read()
-        #treesitter_cache[key] = treesitter_ast(contents)
-        treesitter_cache[key] = treesitter_ast(path)
-    return treesitter_cache[key]
+    ast = treesitter_cache.get(key)
+    if ast is None:
+        language = language_for_path(path)
+        ast = None if persistent_cache is None else persistent_cache.get_ast(path, language)
+        if ast is None:
+            with path.open('r') as file:
+                code = file.read()
+            ast = treesitter_parse(code, language)
+            if persistent_cache is not None:
+                persistent_cache.set_ast(path, language, ast)
+        treesitter_cache[key] = ast
+    else:
+        #Children found since the parse was cached (or last used) weren't charged to the cache.
+        treesitter_cache.recharge(key)
+    return ast
+
+def record_write(path, before, after):
+    """
+    Called just after the agent writes after to path, which previously contained before.
+
+    If we still have the parse of before, along with its tree_sitter.Tree, then the
+    parse of after is incremental, and only rebuilds the definitions touched by the write.
+    """
+    language = language_for_path(path)
+    prev_ast = treesitter_cache.latest(str(path))
+    if prev_ast is not None and prev_ast.source.tree is not None and prev_ast.source.code == before:
+        ast = treesitter_ast_edit(prev_ast, after)
+    else:
+        ast = treesitter_parse(after, language)
+
+    treesitter_cache[file_key(path)] = ast
+    if persistent_cache is not None:
+        persistent_cache.set_ast(path, language, ast)
 
 
 #### Cache doing the binary vs not binary judgement, as that requires reading whole file.
@@ -68,21 +114,33 @@ def _is_utf8(path:Path):
         full_file = file.read()
 
     try:
-        sample.decode('utf-8')
+        full_file.decode('utf-8')
         return True
     except UnicodeDecodeError:
         return False
 
-cache_is_utf8 = {}
+cache_is_utf8 = LRUCache(cache_is_utf8_max_entries, group=key_path)
 def is_utf8(path):
     assert path.exists() and os.access(path, os.R_OK) and path.is_file()
 
     key = file_key(path)
-    if key not in treesitter_cache:
-        cache_is_utf8[key] = _is_utf8(path)
-    return cache_is_utf8[key]
+    verdict = cache_is_utf8.get(key)
+    if verdict is None:
+        verdict = None if persistent_cache is None else persistent_cache.get_is_utf8(path)
+        if verdict is None:
+            verdict = _is_utf8(path)
+            if persistent_cache is not None:
+                persistent_cache.set_is_utf8(path, verdict)
+        cache_is_utf8[key] = verdict
+    return verdict
+
+
 
+excluded_patterns = re.compile(r'^\.|\.swp$|\.egg-info$')
 
+def tracked(filename):
+    assert isinstance(filename, str)
+    return not excluded_patterns.search(filename)
 
 class FullPath():
     def __init__(self, path, *parts):
@@ -163,14 +221,24 @@ class FullPath():
 
     def iterdir_tracked(self):
         """
-        Lists all directories and non-binary files that are tracked (i.e. valid, and non hidden e.g. with a . at the start).
-        """
-        def tracked(filename):
-            assert isinstance(filename, str)
-            excluded_patterns = r'^\.|\.swp$|\.egg-info$'
-            return not re.search(excluded_patterns, filename)
+        Lists all directories and files that are tracked (i.e. non hidden e.g. with a . at the start,
+        and not ignored by a .gitignore or .agentignore file).
 
-        return [p for p in self.iterdir_valid() if tracked(p.path.name)]
+        Uses the file types that os.scandir gets with the directory listing, so doesn't open or
+        parse any files.  So files could still turn out not to be valid code (e.g. if they're binary);
+        that's checked when the code is needed.  Unreadable files are skipped, as is_utf8 can't check them.
+        """
+        assert self.is_valid_dir()
+        ignore = Ignore(self.path)
+        names = []
+        with os.scandir(self.path) as entries:
+            for entry in entries:
+                if not tracked(entry.name):
+                    continue
+                is_dir = entry.is_dir()
+                if (is_dir or entry.is_file()) and os.access(entry.path, os.R_OK) and not ignore(entry.name, is_dir):
+                    names.append(entry.name)
+        return [FullPath(self.path / name) for name in sorted(names)]
 
     def name(self):
         if 0 < len(self.parts):
@@ -206,7 +274,7 @@ class FullPath():
 
     def iter_tracked(self):
         """
-        For a directory, lists directories and non-binary files that aren't hidden (i.e. don't start with a '.').
+        For a directory, lists directories and files that aren't hidden (i.e. don't start with a '.').
         For a file / code block, lists child code blocks.
         """
         assert self.is_valid()
@@ -240,7 +308,7 @@ class FullPath():
 
     def listdir_all(self) -> List[str]:
         assert self.is_valid_dir()
-        return [p.path.name for p in self.iterdir_all()]
+        return sorted(os.listdir(self.path))
 
     def __str__(self):
         parts = '#'.join(self.parts)
@@ -2,9 +2,6 @@ import os
 import json
 import subprocess
 import readline #Just importing readline enables nicer features for the builtin Python input.
-from dataclasses import dataclass
-from typing import Optional, List
-from pathlib import Path
 
 from .state import State
 from .tools import tools_internal
@@ -12,27 +9,18 @@ from .state import initialize_state
 from .parser import parse_writes
 from .exceptions import AgentException
 from .diff import diff
+from .FullPath import record_write
+from .undo import UndoJournal
 
 from .messages import TextBlock, ToolUseBlock, ToolResultBlock
 
 
-@dataclass
-class FileUndoInfo:
-    path: Path
-    before: Optional[str]
-    after: str
-
-@dataclass
-class StateUndoInfo:
-    state: State
-    files_undo_info: List[FileUndoInfo]
-
 def update_state_assistant(state, undo_state):
     """
     Takes user input, and does the things ...
     """ 
 
-    state_undo_info = [] # dict mapping Path to string (full contents of the file).
+    undo_states = {} # dict mapping the id of each step in the undo journal to the State to go back to.
     
     #The last message must be a user message.
     state.messages.assert_ready_for_assistant()
@@ -53,7 +41,7 @@ def update_state_assistant(state, undo_state):
             #if state.file_for_writing is None:
             # Standard text response.
             state = state.append_text("assistant", block.text)
-            state = state.print_assistant(block.text)
+            state = state.log_assistant(block.text)
 
             errors = []
             try:
@@ -62,7 +50,7 @@ def update_state_assistant(state, undo_state):
                 parsed_writes = []
                 errors.append(str(e))
 
-            files_undo_info = []
+            writes = []
             for write in parsed_writes:
                 if isinstance(write, str):
                     continue
@@ -83,18 +71,15 @@ def update_state_assistant(state, undo_state):
                         #Actually do the write. Should work as parser has checked path is valid.
                         with write.full_path.path.open('w') as file:
                             file.write(after_full_file)
+                        record_write(write.full_path.path, before_full_file, after_full_file)
 
-                        #Record file contents after modification.
-                        files_undo_info.append(FileUndoInfo(
-                            path=write.full_path.path, 
-                            before=before_full_file,  
-                            after=after_full_file
-                        ))
+                        #Record file contents before and after modification.
+                        writes.append((write.full_path.path, before_full_file, after_full_file))
                         state = state.append_text("user", f'{write.full_path} successfully written')
                 except AgentException as e:
                     errors.append(str(e))
 
-            state_undo_info.append(StateUndoInfo(state=undo_state, files_undo_info=files_undo_info))
+            undo_states[undo_journal.record(writes)] = undo_state
             
             if errors:
                 errors = '\n'.join(errors)
@@ -121,6 +106,11 @@ def update_state_assistant(state, undo_state):
 
             try:
                 user_refused_permission = False
+                #Only blocks from streamed responses have an error.
+                input_error = getattr(block, 'error', None)
+                if input_error is not None:
+                    raise AgentException(input_error)
+
                 if function_name not in tools_internal:
                     raise AgentException(f"Tool {function_name} not avaliable")
 
@@ -155,13 +145,13 @@ def update_state_assistant(state, undo_state):
             #If the user refused to use the tool, pass back immediately to user to provide more context.
             #Otherwise, recursively call LLM
             if not user_refused_permission:
-                state, later_state_undo_info = update_state_assistant(state, state)
-                state_undo_info = state_undo_info + later_state_undo_info
+                state, later_undo_states = update_state_assistant(state, state)
+                undo_states.update(later_undo_states)
             
         else:
             state = state.print_internal_error(block)
 
-    return state, state_undo_info
+    return state, undo_states
 
 def update_state_user(state, user_input):
     """
@@ -175,8 +165,22 @@ def update_state_user(state, user_input):
 
 state = initialize_state()
 state = state.print_initial_message()
-undo_info = []
-redo_info = []
+undo_journal = UndoJournal(state.hash_dir)
+undo_journal.gc()
+undo_states = {}    # Step id -> State before the step.  Steps from earlier sessions only undo the files.
+redo_states = {}    # Step id -> State after the step, for steps that have been undone.
+
+def confirm_overwrite(state, paths):
+    """
+    Undo/redo would overwrite any changes made to paths since the agent wrote them (e.g. by hand).
+    """
+    if not paths:
+        return state, True
+    return state.confirm_proceed(f"{', '.join(paths)} changed since the agent wrote them.  Overwrite,")
+
+def reprint(state):
+    print('\n\n\n\n\n\n\n')
+    print('\n'.join(state.console_log))
 
 while True:
     state_before_user_input = state
@@ -185,23 +189,34 @@ while True:
     if user_input == "exit":
         break
     elif user_input == "undo":
-        if 0 < len(undo_info):
-            ud = undo_info[-1]
-            undo_info = undo_info[:-1]
-            state = ud.state
-            print('\n\n\n\n\n\n\n')
-            print('\n'.join(state.console_log))
-            for file_undo_info in ud.files_undo_info:
-                path = file_undo_info.path
-                before = file_undo_info.before
-
-                if before is not None:
-                    with path.open('w') as file:
-                        file.write(before)
-                else:
-                    path.unlink()
+        state, proceed = confirm_overwrite(state, undo_journal.undo_conflicts())
+        if not proceed:
+            state = state.print_system("Undo cancelled.")
+        else:
+            step = undo_journal.undo()
+            if step is None:
+                state = state.print_system("Nothing to undo.")
+            elif step in undo_states:
+                redo_states[step] = state_before_user_input
+                state = undo_states[step]
+                reprint(state)
+            else:
+                state = state.print_system("Undid file changes from an earlier session.")
+    elif user_input == "redo":
+        state, proceed = confirm_overwrite(state, undo_journal.redo_conflicts())
+        if not proceed:
+            state = state.print_system("Redo cancelled.")
+        else:
+            step = undo_journal.redo()
+            if step is None:
+                state = state.print_system("Nothing to redo.")
+            elif step in redo_states:
+                state = redo_states[step]
+                reprint(state)
+            else:
+                state = state.print_system("Redid file changes from an earlier session.")
     else:
         #Save the state just before you use the assistant.
         state = update_state_user(state, user_input)
-        state, new_undo_info = update_state_assistant(state, undo_state=state_before_user_input)
-        undo_info = undo_info + new_undo_info
+        state, new_undo_states = update_state_assistant(state, undo_state=state_before_user_input)
+        undo_states.update(new_undo_states)
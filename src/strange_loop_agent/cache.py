@@ -0,0 +1,265 @@
+"""
+In-memory LRU caches, and caches that persist between sessions, stored in
+the hash directory (usually `.agent`).
+
+LRUCache:
+The in-memory caches are keyed on (path, mtime, size), so every edit to a file
+makes a new key.  We bound the total size of the cached values, evicting the
+least recently used first, and drop the entry for the previous version of a
+file as soon as a new version is cached.
+
+PersistentCache:
+
+Treesitter parses are stored as pickle files, named by the hash of the file contents
+(and the language used to parse it, which depends on the file extension).
+So if a file is unchanged (or changed, then changed back) we don't need to reparse it.
+
+To avoid re-hashing every file on every lookup, we keep an index mapping
+paths to the modification time, size and hash of the file when it was last seen.
+The index also records the is_utf8 verdict, which doesn't need a full hash.
+
+Only the part of a (lazily built) parse that has been built so far is pickled, so
+pickling doesn't force the rest to be built.  A parse loaded from the cache reparses
+the file if it needs to find more children (or call sites).
+
+New parses are written in batches of max_pending_asts, which bounds the parses held
+in memory (and lost on a crash), and the work left for exit.  The index is written
+with a batch at most every index_flush_interval seconds.
+
+Everything lives in a versioned subdirectory, so changing the format of the
+cached objects just requires bumping CACHE_VERSION.
+"""
+
+import os
+import json
+import pickle
+import shutil
+import threading
+import time
+from pathlib import Path
+from collections import OrderedDict
+
+from .utils import hash_file
+
+class LRUCache():
+    def __init__(self, max_size, sizeof=lambda value: 1, group=lambda key: key):
+        """
+        max_size: the budget for the total size of all the values.
+        sizeof:   gives the size of a value (by default 1, so the budget is a number of entries).
+        group:    maps a key to e.g. the path, so that adding a new key evicts any
+                  previous keys in the same group.
+        """
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self.group = group
+
+        self.entries = OrderedDict()    # key -> (value, size), least recently used first.
+        self.group_keys = {}            # group -> key
+        self.size = 0
+
+        #Summaries can be refreshed in a thread pool (see summary.make_pool).  Reentrant, as e.g. __setitem__ calls remove.
+        self.lock = threading.RLock()
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key][0]
+            else:
+                return default
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            group = self.group(key)
+            prev_key = self.group_keys.get(group)
+            if prev_key is not None:
+                #Either the same key, or a superseded key for the same group.
+                self.remove(prev_key)
+
+            size = self.sizeof(value)
+            self.entries[key] = (value, size)
+            self.group_keys[group] = key
+            self.size += size
+            self.evict()
+
+    def recharge(self, key):
+        """
+        Recomputes the size of the value for key, for values that grow after they're added
+        (e.g. lazily built parses).
+        """
+        with self.lock:
+            if key in self.entries:
+                value, size = self.entries[key]
+                new_size = self.sizeof(value)
+                self.entries[key] = (value, new_size)
+                self.size += new_size - size
+                self.evict()
+
+    def evict(self):
+        #Evict least recently used, but always keep the most recently used entry.
+        with self.lock:
+            while self.max_size < self.size and 1 < len(self.entries):
+                self.remove(next(iter(self.entries)))
+
+    def latest(self, group):
+        """
+        The value for the most recently added key in group (e.g. the latest version of a file).
+        Doesn't count as a hit or miss.
+        """
+        with self.lock:
+            key = self.group_keys.get(group)
+            return None if key is None else self.entries[key][0]
+
+    def remove(self, key):
+        with self.lock:
+            _, size = self.entries.pop(key)
+            self.size -= size
+            del self.group_keys[self.group(key)]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.group_keys.clear()
+            self.size = 0
+
+
+CACHE_VERSION = 9
+CACHE_PREFIX = 'ast_cache_v'
+max_pending_asts = 16
+index_flush_interval = 30       # seconds
+
+class PersistentCache():
+    def __init__(self, hash_dir):
+        self.hash_dir = Path(hash_dir)
+        self.dir = self.hash_dir / f'{CACHE_PREFIX}{CACHE_VERSION}'
+        self.dir.mkdir(parents=True, exist_ok=True)
+
+        self.index_path = self.dir / 'index.json'
+        self.index = self.load_index()
+        self.dirty = False
+        #ast_path -> parse, for parses that haven't been written yet.
+        self.pending_asts = {}
+        self.index_flushed_at = time.monotonic()
+        self.lock = threading.RLock()
+
+    def load_index(self):
+        try:
+            with self.index_path.open('r') as file:
+                return json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def flush(self):
+        """
+        Writes any new parses, and the index (if it has changed) to disk.
+        """
+        with self.lock:
+            self.flush_asts()
+            if self.dirty:
+                tmp_path = self.index_path.with_suffix('.tmp')
+                with tmp_path.open('w') as file:
+                    json.dump(self.index, file)
+                os.replace(tmp_path, self.index_path)
+                self.dirty = False
+                self.index_flushed_at = time.monotonic()
+
+    def flush_asts(self):
+        with self.lock:
+            for ast_path, ast in self.pending_asts.items():
+                tmp_path = ast_path.with_suffix(f'.{os.getpid()}.tmp')
+                with tmp_path.open('wb') as file:
+                    pickle.dump(ast, file, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, ast_path)
+            self.pending_asts = {}
+
+    def entry(self, path):
+        """
+        Returns the index entry for path, resetting it if the file has changed since it was recorded.
+        """
+        with self.lock:
+            stat = path.stat()
+            key = str(path)
+            entry = self.index.get(key)
+            if entry is None or entry['mtime'] != stat.st_mtime or entry['size'] != stat.st_size:
+                entry = {'mtime': stat.st_mtime, 'size': stat.st_size}
+                self.index[key] = entry
+                self.dirty = True
+            return entry
+
+    def content_hash(self, path):
+        with self.lock:
+            entry = self.entry(path)
+            if 'hash' not in entry:
+                entry['hash'] = hash_file(path)
+                self.dirty = True
+            return entry['hash']
+
+    def ast_path(self, _hash, language):
+        return self.dir / f'{_hash}-{language}.pickle'
+
+    #### is_utf8 verdicts.
+    def get_is_utf8(self, path):
+        return self.entry(path).get('is_utf8')
+
+    def set_is_utf8(self, path, value):
+        with self.lock:
+            self.entry(path)['is_utf8'] = value
+            self.dirty = True
+
+    #### Treesitter parses.
+    def get_ast(self, path, language):
+        """
+        Returns the cached treesitter parse of path, or None if there isn't one.
+        """
+        with self.lock:
+            ast_path = self.ast_path(self.content_hash(path), language)
+            if ast_path in self.pending_asts:
+                return self.pending_asts[ast_path]
+        try:
+            with ast_path.open('rb') as file:
+                return pickle.load(file)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            #Corrupt or unreadable entry; treat as a miss, and it'll be overwritten.
+            return None
+
+    def set_ast(self, path, language, ast):
+        with self.lock:
+            self.pending_asts[self.ast_path(self.content_hash(path), language)] = ast
+            if max_pending_asts <= len(self.pending_asts):
+                #Writing the whole index for every batch would be quadratic, so only write it every so often.
+                if index_flush_interval < time.monotonic() - self.index_flushed_at:
+                    self.flush()
+                else:
+                    self.flush_asts()
+
+    def gc(self):
+        """
+        Removes:
+          caches from other versions,
+          index entries for files that no longer exist,
+          parses that aren't referenced by any index entry.
+        """
+        for name in os.listdir(self.hash_dir):
+            if name.startswith(CACHE_PREFIX) and name != self.dir.name:
+                shutil.rmtree(self.hash_dir / name, ignore_errors=True)
+
+        for key in [*self.index.keys()]:
+            if not os.path.isfile(key):
+                del self.index[key]
+                self.dirty = True
+
+        referenced = set(entry['hash'] for entry in self.index.values() if 'hash' in entry)
+        for name in os.listdir(self.dir):
+            path = self.dir / name
+            if name.endswith('.tmp') or (name.endswith('.pickle') and name.split('-')[0] not in referenced):
+                path.unlink(missing_ok=True)
+
+        self.flush()
@@ -6,11 +6,19 @@ from tree_sitter_languages import get_language, get_parser
 # Dictionary mapping file extensions to programming languages
 EXTENSION_TO_LANGUAGE = {
     '.py': 'python',
+    '.pyi': 'python',
     '.js': 'javascript',
+    '.jsx': 'javascript',
+    '.mjs': 'javascript',
+    '.cjs': 'javascript',
     '.ts': 'typescript',
+    '.tsx': 'tsx',
     '.java': 'java',
     '.c': 'c',
+    '.h': 'c',
     '.cpp': 'cpp',
+    '.cc': 'cpp',
+    '.hpp': 'cpp',
     '.cs': 'c_sharp',
     '.rb': 'ruby',
     '.go': 'go',
@@ -18,6 +26,7 @@ EXTENSION_TO_LANGUAGE = {
     '.php': 'php',
     '.swift': 'swift',
     '.kt': 'kotlin',
+    '.kts': 'kotlin',
     '.scala': 'scala',
     '.hs': 'haskell',
     '.ml': 'ocaml',
@@ -0,0 +1,151 @@
+"""
+Base class for indexes over every tracked file under a root directory (usually
+the directory the agent was started in), e.g. the symbol index and the search index.
+
+Keeps an entry for each file, along with its modification time and size, and keeps
+the entries up to date:
+  at the first refresh, we stat every tracked file, and only re-index files whose
+    modification time or size doesn't match the entry (e.g. from a saved index),
+  after that, a watcher (see watcher.py) tells us which files changed.
+The first refresh can take a while for a big tree, so it can be started in the
+background (refresh_in_background), and lookups wait for it to finish.
+
+Subclasses implement:
+  index_file(path):        returns a dict of the information to keep about the file,
+  add_entry(key, entry):   called when an entry is added,
+  remove_entry(key, entry): called when an entry is removed,
+so they can keep e.g. a reverse index consistent with the entries.
+"""
+
+import os
+import threading
+from pathlib import Path
+
+from .FullPath import FullPath, tracked
+from .ignore import Ignore, ignore_filenames
+from .watcher import make_watcher
+
+class FileIndex():
+    def __init__(self, root, watcher=None):
+        self.root = Path(root).resolve()
+        self.files = {}             # str(path) -> {'mtime', 'size', ...}
+        self.dirty = False
+
+        #The watcher can be shared, as each index records its own sequence number.
+        self.watcher = make_watcher() if watcher is None else watcher
+        self.dirs = set()           # Directories that have been scanned.
+        self.seq = None             # Watcher sequence number at the last refresh, or None before the first scan.
+        self.lock = threading.Lock()    # Held while refreshing.
+
+    def index_file(self, path:Path):
+        raise NotImplementedError()
+
+    def add_entry(self, key, entry):
+        pass
+
+    def remove_entry(self, key, entry):
+        pass
+
+    def remove_file(self, key):
+        entry = self.files.pop(key, None)
+        if entry is not None:
+            self.remove_entry(key, entry)
+            self.dirty = True
+
+    def remove_below(self, path:Path):
+        """
+        Removes a file, or everything in a directory.
+        """
+        key = str(path)
+        if key in self.files:
+            self.remove_file(key)
+        else:
+            prefix = key + os.sep
+            for file_key in [k for k in self.files if k.startswith(prefix)]:
+                self.remove_file(file_key)
+            self.dirs = set(d for d in self.dirs if not (d == path or str(d).startswith(prefix)))
+
+    def update_file(self, path:Path, seen=None):
+        #Watch before reading, so we see any changes after we read.
+        self.watcher.watch(path)
+        key = str(path)
+        if seen is not None:
+            seen.add(key)
+        try:
+            stat = path.stat()
+        except OSError:
+            self.remove_file(key)
+            return
+        if not os.access(path, os.R_OK):
+            #e.g. a watched file whose permissions changed.
+            self.remove_file(key)
+            return
+
+        entry = self.files.get(key)
+        if entry is not None and entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size:
+            return
+
+        self.remove_file(key)
+        entry = {'mtime': stat.st_mtime, 'size': stat.st_size, **self.index_file(path)}
+        self.files[key] = entry
+        self.add_entry(key, entry)
+        self.dirty = True
+
+    def scan(self, directory:Path, seen=None, recursive=True):
+        """
+        Updates every file in directory, and (if recursive) in any subdirectories.
+        Subdirectories that haven't been scanned before are always scanned.
+        """
+        if not FullPath(directory).is_valid_dir():
+            return
+        self.watcher.watch(directory)
+        self.dirs.add(directory)
+        for child in FullPath(directory).iterdir_tracked():
+            if child.path.is_dir():
+                if recursive or child.path not in self.dirs:
+                    self.scan(child.path, seen)
+            else:
+                self.update_file(child.path, seen)
+
+    def full_scan(self):
+        seen = set()
+        self.dirs = set()
+        self.scan(self.root, seen)
+        #Files that weren't seen have been deleted (or are now ignored).
+        for key in [key for key in self.files if key not in seen]:
+            self.remove_file(key)
+
+    def is_tracked(self, path:Path):
+        if path == self.root:
+            return True
+        return (
+            tracked(path.name) and
+            path.parent in self.dirs and
+            not Ignore(path.parent)(path.name, path.is_dir())
+        )
+
+    def refresh(self):
+        with self.lock:
+            seq = self.watcher.poll()
+            changed = None if self.seq is None else self.watcher.changed_paths(self.seq)
+            if changed is not None and any(path.name in ignore_filenames for path in changed):
+                #The ignore files changed, so anything could be tracked or ignored now.
+                changed = None
+
+            if changed is None:
+                self.full_scan()
+            else:
+                for path in changed:
+                    if not path.is_relative_to(self.root):
+                        #e.g. a watcher shared with another index, over a different root.
+                        continue
+                    elif not (path.exists() and self.is_tracked(path)):
+                        self.remove_below(path)
+                    elif path.is_dir():
+                        self.scan(path, recursive=False)
+                    else:
+                        self.update_file(path)
+            self.seq = seq
+
+    def refresh_in_background(self):
+        threading.Thread(target=self.refresh, daemon=True).start()
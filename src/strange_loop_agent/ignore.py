@@ -0,0 +1,90 @@
+"""
+Ignore files, so we don't explore e.g. build directories, virtualenvs or node_modules.
+
+Like git, ignore files apply to the directory they're in, and everything below it,
+and patterns in deeper ignore files take precedence.  We use .gitignore files, the
+repo's .git/info/exclude, and .agentignore files (which have the same format, but
+only affect the agent).  We look for ignore files up to the top level of the git repo.
+Outside a repo, git wouldn't use any of them, so we only use those up to the agent
+root (the directory the agent was started in).
+
+The patterns for each directory are compiled once, and cached (until one of the
+ignore files in that directory changes).
+"""
+
+from pathlib import Path
+
+import pathspec
+
+from .cache import LRUCache
+
+ignore_filenames = ['.gitignore', '.agentignore']
+
+def ignore_files(directory:Path):
+    result = [directory / filename for filename in ignore_filenames]
+    if (directory / '.git').is_dir():
+        result.append(directory / '.git' / 'info' / 'exclude')
+    return result
+
+def mtime(path:Path):
+    try:
+        return path.stat().st_mtime
+    except OSError:
+        return None
+
+def read_lines(path:Path):
+    try:
+        with path.open('r', errors='replace') as file:
+            return file.read().splitlines()
+    except OSError:
+        return []
+
+#### (directory, mtimes of ignore files) -> compiled spec for the directory (or None if there are no patterns).
+directory_specs = LRUCache(10000, group=lambda key: key[0])
+
+def directory_spec(directory:Path):
+    paths = ignore_files(directory)
+    key = (str(directory), tuple(mtime(path) for path in paths))
+    if key not in directory_specs:
+        lines = [line for path in paths for line in read_lines(path)]
+        directory_specs[key] = pathspec.GitIgnoreSpec.from_lines(lines) if lines else None
+    return directory_specs.get(key)
+
+def is_repo_root(directory:Path):
+    return (directory / '.git').exists()
+
+def specs(directory:Path):
+    """
+    Returns a list of (directory, spec), for every ignore file that applies in directory, deepest first.
+    """
+    result = []
+    while True:
+        spec = directory_spec(directory)
+        if spec is not None:
+            result.append((directory, spec))
+        if is_repo_root(directory):
+            return result
+        if directory.parent == directory:
+            #Not in a repo.
+            agent_root = Path.cwd()
+            return [(spec_directory, spec) for (spec_directory, spec) in result if spec_directory.is_relative_to(agent_root)]
+        directory = directory.parent
+
+class Ignore():
+    """
+    Checks names in a single directory, so we only collect the specs for the directory once.
+    """
+    def __init__(self, directory:Path):
+        self.directory = directory
+        self.specs = specs(directory)
+
+    def __call__(self, name:str, is_dir:bool):
+        path = self.directory / name
+        for spec_directory, spec in self.specs:
+            relative_path = path.relative_to(spec_directory).as_posix()
+            if is_dir:
+                relative_path = relative_path + '/'
+            include = spec.check_file(relative_path).include
+            if include is not None:
+                return include
+        return False
@@ -1,9 +1,13 @@
 from collections.abc import Iterable
 
 class Block():
+    #Subclasses set type to match the blocks in Anthropic responses, so streamed responses
+    #(see streaming.py) can be used in the same way.
     pass
 
 class TextBlock(Block):
+    type = 'text'
+
     def __init__(self, text):
         isinstance(text, str)
 
@@ -13,13 +17,19 @@ class TextBlock(Block):
         return {'type': 'text', 'text': self.text}
 
 class ToolUseBlock(Block):
-    def __init__(self, _id, name, _input):
+    type = 'tool_use'
+
+    def __init__(self, _id, name, _input, error=None):
+        """
+        error is set if the input couldn't be parsed (see streaming.py), and isn't sent back to the model.
+        """
         isinstance(_id, str)
         isinstance(name, str)
         isinstance(_input, dict)
         self.id = _id
         self.name = name
         self.input = _input
+        self.error = error
     
     def dump(self):
         return {'type': 'tool_use', 'id': self.id, 'name': self.name, 'input': self.input}
@@ -28,6 +38,8 @@ class ToolResultBlock(Block):
     """
     Tool results turn up in user blocks, so also cacheable.
     """
+    type = 'tool_result'
+
     def __init__(self, tool_use_id, content):
         isinstance(tool_use_id, str)
         isinstance(content, str)
@@ -38,59 +50,122 @@ class ToolResultBlock(Block):
     def dump(self):
         return {'type': 'tool_result', 'tool_use_id': self.tool_use_id, 'content': self.content}
 
+class Log():
+    """
+    Persistent append-only list.  Appending (or replacing the last item) returns a new Log
+    that shares all the previous items, so it's O(1), and the old Log is unchanged.  That
+    matters because undo keeps old States (and hence old Messages) around.
+    """
+    __slots__ = ('prev', 'last', 'length')
+
+    def __init__(self, prev=None, last=None):
+        """
+        Log() is empty.  Use append to add items.
+        """
+        self.prev = prev
+        self.last = last
+        self.length = 0 if prev is None else prev.length + 1
+
+    def append(self, item):
+        return Log(self, item)
+
+    def replace_last(self, item):
+        assert 0 < self.length
+        return Log(self.prev, item)
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        items = []
+        log = self
+        while 0 < log.length:
+            items.append(log.last)
+            log = log.prev
+        return reversed(items)
+
+def to_log(items, _type):
+    """
+    Converts an iterable to a Log, checking the type of each item.
+    Logs are passed through without checking again, as items were checked as they were added.
+    """
+    assert isinstance(items, Iterable)
+    if isinstance(items, Log):
+        return items
+    result = Log()
+    for item in items:
+        assert isinstance(item, _type)
+        result = result.append(item)
+    return result
+
 class Message():
     def __init__(self, role, blocks):
         assert role in ['user', 'assistant']
         self.role = role
-
-        assert isinstance(blocks, Iterable)
-        self.blocks = tuple(blocks)
-        for block in self.blocks:
-            assert isinstance(block, Block)
+        self.blocks = to_log(blocks, Block)
+        self._dump = None
 
     def append_block(self, role, block):
         assert self.role == role
-        return Message(role, [*self.blocks, block])
+        assert isinstance(block, Block)
+        return Message(role, self.blocks.append(block))
 
     def dump(self):
-        content = [block.dump() for block in self.blocks]
-        return {'role': self.role, 'content': content}
+        """
+        Messages are immutable, so they're only converted once.  So don't modify the result!
+        """
+        if self._dump is None:
+            content = [block.dump() for block in self.blocks]
+            self._dump = {'role': self.role, 'content': content}
+        return self._dump
+
+    def dump_with_cache_control(self):
+        """
+        Marks the end of a prefix of the messages to cache (using a copy, so the memoized dump is unchanged).
+        """
+        dump = self.dump()
+        first_block, *other_blocks = dump['content']
+        return {**dump, 'content': [{**first_block, 'cache_control': {"type": "ephemeral"}}, *other_blocks]}
 
 
 class Messages():
     def __init__(self, messages):
-        assert isinstance(messages, Iterable)
-        self.messages = tuple(messages)
-        for m in self.messages:
-            assert isinstance(m, Message)
-
-    def dump(self):
-        return [m.dump() for m in self.messages]
+        self.messages = to_log(messages, Message)
+
+    def dump(self, cache_breakpoints=()):
+        """
+        cache_breakpoints are the indices of messages to mark with cache_control.
+        """
+        messages = [*self.messages]
+        result = [m.dump() for m in messages]
+        for i in cache_breakpoints:
+            if -len(result) <= i < len(result):
+                result[i] = messages[i].dump_with_cache_control()
+        return result
 
     def append_message(self, message):
         assert isinstance(message, Message)
         if 0 < len(self.messages):
-            assert message.role != self.messages[-1].role
-        return Messages([*self.messages, message])
+            assert message.role != self.messages.last.role
+        return Messages(self.messages.append(message))
 
     def append_block(self, role, block):
         assert isinstance(role, str)
         assert isinstance(block, Block)
 
-        if 0 < len(self.messages) and role == self.messages[-1].role:
+        if 0 < len(self.messages) and role == self.messages.last.role:
             #Same role as previous, so append block to previous message.
-            updated_message = self.messages[-1].append_block(role, block)
-            return Messages([*self.messages[:-1], updated_message])
+            updated_message = self.messages.last.append_block(role, block)
+            return Messages(self.messages.replace_last(updated_message))
         else:
-            #Same role as previous, so make new message
+            #Different role to previous, so make new message
             return self.append_message(Message(role, [block]))
 
     def append_text(self, role, text):
         return self.append_block(role, TextBlock(text))
 
     def assert_ready_for_user_input(self):
-        return 0 == len(self.messages) or self.messages[-1].role == "assistant"
+        return 0 == len(self.messages) or self.messages.last.role == "assistant"
 
     def assert_ready_for_assistant(self):
-        return 0 != len(self.messages) and self.messages[-1].role == "user"
-
+        return 0 != len(self.messages) and self.messages.last.role == "user"
@@ -1,6 +1,7 @@
 import openai
 import anthropic
 from .messages import Messages
+from .streaming import anthropic_stream_to_response, openai_stream_to_response
 
 _openai_client = openai.OpenAI()
 _anthropic_client = anthropic.Anthropic()
@@ -23,8 +24,7 @@ class OpenAIClient(Client):
             })
         return result
 
-    def response(self, model, system_message, messages, cache, **kwargs):
-        #Ignores the cache argument.
+    def request(self, system_message, messages, **kwargs):
         if 'tools' in kwargs:
             kwargs['tools'] = self.tools(kwargs['tools'])
 
@@ -33,6 +33,11 @@ class OpenAIClient(Client):
             "content" : system_message
         }
         messages = [system_message, *messages.dump()]
+        return messages, kwargs
+
+    def response(self, model, system_message, messages, cache, **kwargs):
+        #Ignores the cache argument.
+        messages, kwargs = self.request(system_message, messages, **kwargs)
  
         response = _openai_client.beta.chat.completions.parse(#) chat.completions.create(
             model=model,
@@ -41,6 +46,18 @@ class OpenAIClient(Client):
         )
         return response
 
+    def stream(self, model, system_message, messages, cache, on_text, **kwargs):
+        #Ignores the cache argument.
+        messages, kwargs = self.request(system_message, messages, **kwargs)
+
+        chunks = _openai_client.chat.completions.create(
+            model=model,
+            messages=messages,
+            stream=True,
+            **kwargs,
+        )
+        return openai_stream_to_response(chunks, on_text)
+
     def response_to_text(self, response):
         assert 1==len(response.choices)
         return response.choices[0].message.content
@@ -56,20 +73,20 @@ class AnthropicClient(Client):
             })
         return result
 
-    def response(self, model, system_message, messages, cache, **kwargs):
+    def create(self, model, system_message, messages, cache, **kwargs):
         if 'tools' in kwargs:
             kwargs['tools'] = self.tools(kwargs['tools'])
  
-        dumped_messages = messages.dump()
-
+        #Cache breakpoints on the last two user messages.
+        cache_breakpoints = []
         if cache:
-            if 1 <= len(dumped_messages):
-                assert dumped_messages[-1]['role'] == 'user'
-                dumped_messages[-1]['content'][0]['cache_control'] = {"type": "ephemeral"}
-
-            if 3 <= len(dumped_messages):
-                assert dumped_messages[-3]['role'] == 'user'
-                dumped_messages[-3]['content'][0]['cache_control'] = {"type": "ephemeral"}
+            if 1 <= len(messages.messages):
+                cache_breakpoints.append(-1)
+            if 3 <= len(messages.messages):
+                cache_breakpoints.append(-3)
+        dumped_messages = messages.dump(cache_breakpoints)
+        for i in cache_breakpoints:
+            assert dumped_messages[i]['role'] == 'user'
 
         funcs = {
             True: _anthropic_client.beta.prompt_caching.messages.create,
@@ -79,12 +96,19 @@ class AnthropicClient(Client):
         response = funcs[cache](
             model=model,
             system=system_message,
-            messages = messages.dump(),
+            messages = dumped_messages,
             max_tokens = 4096,
             **kwargs,
         )
         return response
 
+    def response(self, model, system_message, messages, cache, **kwargs):
+        return self.create(model, system_message, messages, cache, **kwargs)
+
+    def stream(self, model, system_message, messages, cache, on_text, **kwargs):
+        events = self.create(model, system_message, messages, cache, stream=True, **kwargs)
+        return anthropic_stream_to_response(events, on_text)
+
     def response_to_text(self, response):
         assert 1 == len(response.content)
         return response.content[0].text
@@ -100,6 +124,13 @@ class Model:
     def response(self, system_message, messages, cache=True, **kwargs):
         return self.client.response(self.model, system_message, messages, cache, **kwargs)
 
+    def stream(self, system_message, messages, on_text, cache=True, **kwargs):
+        """
+        Like response, but calls on_text with each piece of text as it arrives.
+        Returns a response with content blocks (see streaming.py), for either client.
+        """
+        return self.client.stream(self.model, system_message, messages, cache, on_text, **kwargs)
+
     def response_text(self, system_message, messages, cache=True, **kwargs):
         response = self.response(system_message, messages, cache=cache, **kwargs)
         return self.client.response_to_text(response)
@@ -14,7 +14,7 @@ class Modification:
 
         #If there's parts, then load up only the part that we're using.
         if 0 < len(self.full_path.parts):
-            ts = path.treesitter_ast()
+            ts = self.full_path.treesitter_ast()
             before = ts.code
         else:
             before = before_full_file
@@ -24,7 +24,7 @@ class Modification:
         #Merge it back into the file, taking account of parts.
         if 0 < len(self.full_path.parts):
             before_full_file_lines = before_full_file.split('\n')
-            after_full_file = '\n'.join(before_full_file_lines[:ts.start_line]) + self.after + '\n'.join(before_full_file_lines[ts.end_line:])
+            after_full_file = '\n'.join([*before_full_file_lines[:ts.start_line], after, *before_full_file_lines[ts.end_line:]])
         else:
             after_full_file = after
 
@@ -72,53 +72,105 @@ class Replace(Modification):
         else:
             return before.replace(self.pattern, self.replacement)
 
+#The path can't span lines, so an opening tag split across chunks is always on the last line.
+open_tag = re.compile(r'<(write|replace) path=[\'"](.+?)[\'"]>')
+open_tag_prefixes = ['<write path=', '<replace path=']
+
+def could_be_open_tag(s):
+    """
+    Whether s (which starts with '<') could be the start of an opening tag, cut off at the end of a chunk.
+    """
+    for prefix in open_tag_prefixes:
+        if prefix.startswith(s):
+            return True
+        if s.startswith(prefix):
+            rest = s[len(prefix):]
+            return rest == '' or (rest[0] in '\'"' and '\n' not in rest)
+    return False
+
+def make_replace(path, content):
+    pattern_match = re.search(r'<pattern>(.*?)</pattern>', content, re.DOTALL)
+    replacement_match = re.search(r'<replacement>(.*?)</replacement>', content, re.DOTALL)
+    if not pattern_match or not replacement_match:
+        raise AgentException("Invalid <replace> structure.  No writes or replacements performed.")
+    return Replace(path, pattern_match.group(1).strip(), replacement_match.group(1).strip())
+
+class WriteParser():
+    """
+    Single pass parser for the <write> and <replace> tags in text from the agent.
+    The text can be fed in chunks (e.g. as it's streamed), and each Write or Replace
+    is returned as soon as its closing tag arrives.
+
+    Each chunk is only scanned once, apart from a short tail that could be the start of
+    a tag cut off at the end of the chunk, so parsing is linear in the length of the text.
+    """
+    def __init__(self):
+        self.tag = None         # None in plain text, otherwise ('write' or 'replace', path) for the open tag.
+        self.chunks = []        # The current plain text or tag body, up to the tail.
+        self.tail = ''          # The end of the last chunk, which could be the start of a tag.
+
+    def feed(self, chunk:str):
+        """
+        Returns a list of the strings, Writes and Replaces completed by chunk.
+        """
+        result = []
+        data = self.tail + chunk
+        pos = 0
+        while True:
+            if self.tag is None:
+                match = open_tag.search(data, pos)
+                if match is None:
+                    #Hold back anything on the last line that could be the start of a tag.
+                    k = len(data)
+                    lt = data.find('<', max(pos, data.rfind('\n') + 1))
+                    while lt != -1:
+                        if could_be_open_tag(data[lt:]):
+                            k = lt
+                            break
+                        lt = data.find('<', lt + 1)
+                    break
+                text = ''.join([*self.chunks, data[pos:match.start()]])
+                if text:
+                    result.append(text.strip())
+                self.chunks = []
+                self.tag = (match.group(1), match.group(2))
+                pos = match.end()
+            else:
+                kind, path = self.tag
+                close_tag = f'</{kind}>'
+                end = data.find(close_tag, pos)
+                if end == -1:
+                    #Hold back anything that could be the start of the closing tag.
+                    k = max(pos, len(data) - len(close_tag) + 1)
+                    break
+                content = ''.join([*self.chunks, data[pos:end]])
+                if kind == 'write':
+                    result.append(Write(path, content.strip()))
+                else:
+                    result.append(make_replace(path, content))
+                self.chunks = []
+                self.tag = None
+                pos = end + len(close_tag)
+
+        self.chunks.append(data[pos:k])
+        self.tail = data[k:]
+        return result
+
+    def close(self):
+        """
+        Call at the end of the text.  Returns the remaining plain text, if any.
+        """
+        if self.tag is not None:
+            raise AgentException(f"Unclosed <{self.tag[0]}> tag.  No writes or replacements performed.")
+        text = ''.join([*self.chunks, self.tail])
+        self.chunks = []
+        self.tail = ''
+        return [text.strip()] if text else []
+
 def parse_writes(text: str) -> List[Union[str, Write, Replace]]:
     """
     Takes the text returned by an agent, and returns a list of either strings,
     Writes or Replace's
     """
-    result = []
-    i = 0
-    
-    while i < len(text):
-        # Check for Write structure
-        write_match = re.match(r'<write path=[\'"](.+?)[\'"]>', text[i:])
-        if write_match:
-            path = write_match.group(1)
-            start = i + write_match.end()
-            end = text.find('</write>', start)
-            if end == -1:
-                raise AgentException("Unclosed <write> tag.  No writes or replacements performed.")
-            content = text[start:end].strip()
-            result.append(Write(path, content))
-            i = end + len('</write>')
-            continue
-        
-        # Check for Replace structure
-        replace_match = re.match(r'<replace path=[\'"](.+?)[\'"]>', text[i:])
-        if replace_match:
-            path = replace_match.group(1)
-            start = i + replace_match.end()
-            end = text.find('</replace>', start)
-            if end == -1:
-                raise AgentException("Unclosed <replace> tag.  No writes or replacements performed.")
-            content = text[start:end]
-            pattern_match = re.search(r'<pattern>(.*?)</pattern>', content, re.DOTALL)
-            replacement_match = re.search(r'<replacement>(.*?)</replacement>', content, re.DOTALL)
-            if not pattern_match or not replacement_match:
-                raise AgentException("Invalid <replace> structure.  No writes or replacements performed.")
-            pattern = pattern_match.group(1).strip()
-            replacement = replacement_match.group(1).strip()
-            result.append(Replace(path, pattern, replacement))
-            i = end + len('</replace>')
-            continue
-        
-        # If not a special structure, accumulate plain text
-        text_end = next((j for j in range(i, len(text)) if text[j:].startswith('<write') or text[j:].startswith('<replace')), len(text))
-        if text_end > i:
-            result.append(text[i:text_end].strip())
-            i = text_end
-        else:
-            i += 1
-    
-    return result
+    parser = WriteParser()
+    return [*parser.feed(text), *parser.close()]
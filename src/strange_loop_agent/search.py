@@ -0,0 +1,175 @@
+"""
+Full-text search over every tracked file, using a trigram index.
+
+The index maps each trigram (three consecutive characters, casefolded) to the files
+containing it.  To search, we only read the files that contain every trigram in the
+query, and stop as soon as we have enough results.  The index is kept up to date
+with the files (see file_index.py), but only lives in memory.
+
+Postings are arrays of file ids.  When a file changes, it gets a new id, and the old
+id is left in the postings (and skipped), until there are enough old ids that it's
+worth compacting the postings.
+"""
+
+import os
+from array import array
+from pathlib import Path
+
+from .FullPath import FullPath, is_utf8, treesitter_file_ast
+from .file_index import FileIndex
+
+def trigrams(text:str):
+    return {text[i:i+3] for i in range(len(text)-2)}
+
+class TrigramIndex(FileIndex):
+    def __init__(self, root, watcher=None):
+        super().__init__(root, watcher)
+        self.postings = {}          # trigram -> array of file ids
+        self.keys = []              # file id -> str(path), or None if the file has changed since.
+        self.dead = 0               # Number of ids that are None.
+
+    def index_file(self, path:Path):
+        if not is_utf8(path):
+            return {}
+        with path.open('r') as file:
+            return {'trigrams': trigrams(file.read().casefold())}
+
+    def add_entry(self, key, entry):
+        #Postings hold the trigrams, so the entry doesn't need to.
+        if 'trigrams' not in entry:
+            #Not UTF-8, so never a candidate (even for queries too short to have trigrams).
+            entry['id'] = None
+            return
+        file_id = len(self.keys)
+        self.keys.append(key)
+        entry['id'] = file_id
+        for trigram in entry.pop('trigrams'):
+            posting = self.postings.get(trigram)
+            if posting is None:
+                posting = self.postings[trigram] = array('i')
+            posting.append(file_id)
+
+    def remove_entry(self, key, entry):
+        if entry['id'] is not None:
+            self.keys[entry['id']] = None
+            self.dead += 1
+
+    def compact(self):
+        """
+        Drops ids for files that have changed from the postings.
+        """
+        new_ids = {}
+        keys = []
+        for file_id, key in enumerate(self.keys):
+            if key is not None:
+                new_ids[file_id] = len(keys)
+                self.files[key]['id'] = len(keys)
+                keys.append(key)
+        for trigram, posting in [*self.postings.items()]:
+            posting = array('i', (new_ids[file_id] for file_id in posting if file_id in new_ids))
+            if posting:
+                self.postings[trigram] = posting
+            else:
+                del self.postings[trigram]
+        self.keys = keys
+        self.dead = 0
+
+    def candidates(self, query:str):
+        """
+        Paths of the files that could contain query, in sorted order.
+        """
+        query_trigrams = trigrams(query.casefold())
+        if query_trigrams:
+            postings = sorted((self.postings.get(trigram, array('i')) for trigram in query_trigrams), key=len)
+            file_ids = set(postings[0])
+            for posting in postings[1:]:
+                if not file_ids:
+                    break
+                file_ids.intersection_update(posting)
+        else:
+            file_ids = range(len(self.keys))
+        return sorted(self.keys[file_id] for file_id in file_ids if self.keys[file_id] is not None)
+
+    def search(self, query:str, max_results:int, ignore_case=False):
+        """
+        Returns (matches, truncated), where matches is a list of (FullPath, line number, line)
+        with at most max_results matches, and truncated says whether there were more.
+        """
+        self.refresh()
+        if len(self.keys) < 2 * self.dead:
+            self.compact()
+
+        results = []
+        for key in self.candidates(query):
+            for match in search_file(Path(key), query, ignore_case):
+                if len(results) >= max_results:
+                    return results, True
+                results.append(match)
+        return results, False
+
+def search_file(path:Path, query:str, ignore_case:bool):
+    """
+    Yields (FullPath, line number, line) for every line in path that contains query.
+    The FullPath is for the innermost function/class (or code block) containing the line.
+    """
+    #Also checked by the index, but the file could have changed since.
+    if not (path.is_file() and os.access(path, os.R_OK) and is_utf8(path)):
+        return
+    try:
+        with path.open('r') as file:
+            text = file.read()
+    except (OSError, UnicodeDecodeError):
+        return
+    #casefold can change the length of the text (e.g. 'ß' -> 'ss'), but not the newlines,
+    #so positions are only used in the haystack, and lines are taken from text by line number.
+    haystack, needle = (text.casefold(), query.casefold()) if ignore_case else (text, query)
+
+    ast = None
+    lines = None
+    line_number = 0
+    line_start = 0
+    position = haystack.find(needle)
+    while position != -1:
+        line_number += haystack.count('\n', line_start, position)
+        line_start = haystack.rfind('\n', 0, position) + 1
+        line_end = haystack.find('\n', position)
+        line_end = len(haystack) if line_end == -1 else line_end
+
+        if ast is None:
+            ast = treesitter_file_ast(path)
+            lines = text.split('\n')
+        yield (FullPath(path, *parts_containing(ast, line_number)), line_number+1, lines[line_number])
+
+        #One match per line.  A query starting with a newline ends the line it matches on, so always move on.
+        position = haystack.find(needle, max(line_end, position+1))
+
+def parts_containing(ast, line):
+    parts = []
+    node = ast
+    while True:
+        for name, child in node.children.items():
+            if child.start_line <= line < child.end_line:
+                parts.append(name)
+                node = child
+                break
+        else:
+            return parts
+
+
+#### Shared index, set up in initialize_state.
+search_index = None
+max_line_length = 200
+
+def set_search_index(index):
+    global search_index
+    search_index = index
+
+def search_message(query, max_results=50):
+    matches, truncated = search_index.search(query, max_results)
+    lines = [f'{path} line {line_number}: {line.strip()[:max_line_length]}' for (path, line_number, line) in matches]
+    if truncated:
+        lines.append(f'... stopped after {max_results} matches')
+    if not matches:
+        lines.append(f'No matches for {query}.')
+    lines = '\n'.join(lines)
+    return f'<search query={query}>\n{lines}\n</search>'
@@ -1,5 +1,6 @@
 import os
 import json
+import atexit
 import subprocess
 import shutil
 from pathlib import Path
@@ -11,15 +12,22 @@ from .models import Model, openai_client, anthropic_client
 from .tools import tools_internal
 from .utils import hash_file
 from .system_message import system_message
-from .summary import SummaryDict, add_summaries_from_token_sources, update_delete_summaries
-from .FullPath import full_path
-
-from .messages import Messages
+from .summary import SummaryDict, add_summaries_from_token_sources, add_git_summary, update_delete_summaries, set_watcher, set_pool, make_pool
+from .watcher import make_watcher
+from .FullPath import full_path, set_persistent_cache
+from .cache import PersistentCache
+from .symbols import SymbolIndex, set_symbol_index
+from .search import TrigramIndex, set_search_index
+
+from .messages import Messages, Log
 from .formatting import color
 
 default_config = {
     'max_tokens' : 4096,
+    'stream' : True,                # Print the assistant's response as it arrives.
     'hash_dir' : '.agent',
+    'summary_pool' : 'thread',      # 'thread', 'process' or None, for refreshing many changed summaries at once (see summary.make_pool).
+    'summary_workers' : None,       # None uses one worker per CPU.
 }
 
 if os.path.exists('.claude-config'):
@@ -31,6 +39,9 @@ else:
 config = {**default_config, **repo_config}
 
 
+def print_streamed(text):
+    print(color.BLUE+text+color.RESET, end='', flush=True)
+
 #### App state:
 @dataclass(frozen=True)
 class State:
@@ -41,7 +52,8 @@ class State:
     strong_model: Model             # Strong model
     messages: Messages
     summaries: SummaryDict
-    console_log: list
+    stream: bool                    # Stream the strong model's responses
+    console_log: Log                # Shared between States, so printing is O(1) and undo snapshots don't copy the log.
 
     def append_text(self, role, text):
         messages = self.messages.append_text(role, text)
@@ -60,12 +72,23 @@ class State:
         return self.messages#.append_text('user', result)
 
     def assistant_api_call(self):
+        """
+        When streaming, the text is printed as it arrives, so only needs adding to the log (see log_assistant).
+        """
         self.messages.assert_ready_for_assistant()
-        return self.strong_model.response(self.system_message, self.append_state_to_messages(), tools=tools_internal)
+        if self.stream:
+            response = self.strong_model.stream(self.system_message, self.append_state_to_messages(), on_text=print_streamed, tools=tools_internal)
+            print()
+            return response
+        else:
+            return self.strong_model.response(self.system_message, self.append_state_to_messages(), tools=tools_internal)
+
+    def log(self, string):
+        return replace(self, console_log=self.console_log.append(string))
 
     def print(self, string):
         print(string)
-        return replace(self, console_log=[*self.console_log, string])
+        return self.log(string)
 
     def print_User(self):
         return self.print(color.BOLD+"\nUser:"+color.RESET)
@@ -79,6 +102,13 @@ class State:
     def print_assistant(self, string):
         return self.print(color.BLUE+string+color.RESET)
 
+    def log_assistant(self, string):
+        #Streamed text has already been printed.
+        if self.stream:
+            return self.log(color.BLUE+string+color.RESET)
+        else:
+            return self.print_assistant(string)
+
     def print_code(self, string):
         return self.print(color.DARKGREY+string+color.RESET)
 
@@ -96,7 +126,7 @@ class State:
         print(end, end='')
         full_string = start+user_string+end
 
-        return replace(self, console_log=[*self.console_log, full_string]), user_string
+        return self.log(full_string), user_string
 
     def confirm_proceed(self, message="Proceed,"):
         while True:
@@ -116,6 +146,12 @@ class State:
 
         return self, '\n\n\n'.join(messages)
 
+    def add_git_summary(self, path):
+        updated_summaries, messages = add_git_summary(self.summaries, full_path(path))
+        self = replace(self, summaries = updated_summaries)
+
+        return self, '\n\n\n'.join(messages)
+
     def update_summaries(self):
         updated_summaries, messages = update_delete_summaries(self.summaries)
         self = replace(self, summaries = updated_summaries)
@@ -130,9 +166,26 @@ def initialize_state():
     if not os.path.exists(hash_dir):
         os.makedirs(hash_dir, exist_ok=False)
 
-    #Remove all hashed files that aren't referenced
-    for _hash in os.listdir(hash_dir):
-        os.remove(os.path.join(hash_dir, _hash))
+    #Keep treesitter parses between sessions, removing any that aren't referenced.
+    persistent_cache = PersistentCache(hash_dir)
+    persistent_cache.gc()
+    set_persistent_cache(persistent_cache)
+    atexit.register(persistent_cache.flush)
+
+    #Only update summaries for paths that have changed.
+    watcher = make_watcher()
+    set_watcher(watcher)
+    if config['summary_pool'] is not None:
+        set_pool(make_pool(config['summary_pool'], config['summary_workers']))
+
+    #Indexes of every tracked file, built at the first lookup.  They watch every tracked path, so they
+    #get their own watcher, otherwise a polling watcher would stat the whole tree for every summary update.
+    index_watcher = make_watcher()
+    symbol_index = SymbolIndex(hash_dir, Path.cwd(), index_watcher)
+    symbol_index.refresh_in_background()
+    set_symbol_index(symbol_index)
+    atexit.register(symbol_index.flush)
+    set_search_index(TrigramIndex(Path.cwd(), index_watcher))
 
     return State(
         system_message = system_message,
@@ -143,5 +196,6 @@ def initialize_state():
         #strong_model = Model(anthropic_client, 'claude-3-haiku-20240307'),
         messages = Messages([]),
         summaries = {},
-        console_log = [],
+        stream = config["stream"],
+        console_log = Log(),
     )
@@ -0,0 +1,86 @@
+"""
+Assembles streamed model responses into content blocks, calling on_text with each
+piece of text as it arrives, so the response can be printed as it's generated.
+
+The blocks are the same as those in Messages (TextBlock and ToolUseBlock), so the
+streamed response can be used in the same way as a non-streamed Anthropic response.
+Tool inputs arrive as fragments of JSON, which are only parsed once the block is complete.
+"""
+
+import json
+
+from .messages import TextBlock, ToolUseBlock
+
+class StreamedResponse():
+    def __init__(self, content):
+        self.content = content
+
+def tool_use_block(_id, name, fragments):
+    """
+    Invalid JSON (e.g. if the stream stopped at max_tokens part way through a tool call) keeps the block,
+    with an empty input and the error, so the error goes back to the model as the tool result.
+    """
+    text = ''.join(fragments)
+    if not text:
+        return ToolUseBlock(_id, name, {})
+    try:
+        return ToolUseBlock(_id, name, json.loads(text))
+    except json.JSONDecodeError as e:
+        return ToolUseBlock(_id, name, {}, error=f"Invalid JSON as tool input ({e}): {text}")
+
+def anthropic_stream_to_response(events, on_text):
+    """
+    events are the server-sent events from messages.create(..., stream=True).
+    """
+    blocks = {}     # index -> {'type', 'text' or 'id', 'name', 'input'}, where text and input are lists of fragments.
+    for event in events:
+        if event.type == 'content_block_start':
+            block = event.content_block
+            if block.type == 'text':
+                blocks[event.index] = {'type': 'text', 'text': [block.text]}
+                if block.text:
+                    on_text(block.text)
+            elif block.type == 'tool_use':
+                blocks[event.index] = {'type': 'tool_use', 'id': block.id, 'name': block.name, 'input': []}
+        elif event.type == 'content_block_delta':
+            delta = event.delta
+            if delta.type == 'text_delta':
+                blocks[event.index]['text'].append(delta.text)
+                on_text(delta.text)
+            elif delta.type == 'input_json_delta':
+                blocks[event.index]['input'].append(delta.partial_json)
+
+    content = []
+    for _, block in sorted(blocks.items()):
+        if block['type'] == 'text':
+            content.append(TextBlock(''.join(block['text'])))
+        else:
+            content.append(tool_use_block(block['id'], block['name'], block['input']))
+    return StreamedResponse(content)
+
+def openai_stream_to_response(chunks, on_text):
+    """
+    chunks are from chat.completions.create(..., stream=True).  The text comes first,
+    then the tool calls, as OpenAI only gives one message per response.
+    """
+    text = []
+    tool_calls = {}     # index -> {'id', 'name', 'arguments'}, where arguments is a list of fragments.
+    for chunk in chunks:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+        if delta.content:
+            text.append(delta.content)
+            on_text(delta.content)
+        for tool_call in delta.tool_calls or []:
+            call = tool_calls.setdefault(tool_call.index, {'id': None, 'name': '', 'arguments': []})
+            if tool_call.id:
+                call['id'] = tool_call.id
+            if tool_call.function is not None:
+                call['name'] += tool_call.function.name or ''
+                call['arguments'].append(tool_call.function.arguments or '')
+
+    content = [TextBlock(''.join(text))] if text else []
+    for _, call in sorted(tool_calls.items()):
+        content.append(tool_use_block(call['id'], call['name'], call['arguments']))
+    return StreamedResponse(content)
@@ -26,19 +26,49 @@ Critically, each time we run the agent, we check whether the summaries are still
 """
 
 import os
+import heapq
+import subprocess
+import difflib
+import itertools
 from typing import Dict, List, Tuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
-from .FullPath import FullPath, full_path
+from .FullPath import FullPath, full_path, set_persistent_cache
 from .treesitter import treesitter_ast
 from .exceptions import AgentException
+from .tokens import count_tokens
+
+#### Watches the paths of summaries, so we only update summaries that might have changed.
+#### If there's no watcher, every summary is updated every time.
+watcher = None
+
+def set_watcher(_watcher):
+    global watcher
+    watcher = _watcher
 
 #### Classes for summaries
 class Summary():
     def tokens(self):
-        return len(self.contents) / 4
+        if not hasattr(self, '_tokens'):
+            self._tokens = count_tokens(self.contents)
+        return self._tokens
+
+    def watch(self, path):
+        """
+        Called before reading path, so any later change makes the summary stale.
+        """
+        if watcher is None:
+            self.seq = 0
+        else:
+            watcher.watch(path.path)
+            self.seq = watcher.seq
+
+    def is_stale(self):
+        return (watcher is None) or watcher.changed_since(self.path.path, self.seq)
 
 class DirSummary(Summary):
     def __init__(self, path):
+        self.watch(path)
         path.assert_valid_dir()
         self.path = path
         self.contents = '\n'.join(path.listdir_all())
@@ -53,18 +83,41 @@ class DirSummary(Summary):
         return DirSummary(self.path)
 
 class GitSummary(Summary):
-    def __init__(self, path):
-        path.assert_valid_dir()
-
-        result = self.git_ls_files()
-        if result.return_code!=0:
-            raise Exception("{path} is not a valid git repo")
+    """
+    Lists the files tracked by git.  path is the .git directory.
 
+    Listing the files in a big repo is slow, so we only list them again if the index,
+    or the output of `git status`, has changed.
+    """
+    def __init__(self, path, signature=None):
+        path.assert_valid_dir()
         self.path = path
-        self.contents = result.stdout
 
-    def git_ls_files(self):
-        return subprocess.run(f'git --git-dir={self.path} ls-files', shell=True, capture_output=True, text=True)
+        if signature is None:
+            signature = self.signature()
+        self.git_signature = signature
+
+        result = self.git('ls-files', '-z')
+        self.contents = '\n'.join(filename for filename in result.stdout.split('\0') if filename)
+
+    def git(self, *args):
+        result = subprocess.run(
+            ['git', f'--git-dir={self.path.path}', f'--work-tree={self.path.path.parent}', '--no-optional-locks', *args],
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode != 0:
+            raise AgentException(f"{self.path} is not a valid git repo")
+        return result
+
+    def signature(self):
+        """
+        Changes whenever the files tracked by git might have changed.
+        """
+        index = self.path.path / 'index'
+        index_stat = (index.stat().st_mtime_ns, index.stat().st_size) if index.exists() else None
+        status = self.git('status', '--porcelain', '-z', '--untracked-files=no').stdout
+        return (index_stat, status)
 
     def new_message(self):
         return f'<git_repo, path={self.path}>\n{self.contents}\n</git_repo>'
@@ -73,30 +126,102 @@ class GitSummary(Summary):
         return file_list_update_message(self.path, prev_summary.contents, self.contents)
 
     def update(self):
-        return GitSummary(self.path)
+        signature = self.signature()
+        if signature == self.git_signature:
+            return self
+        return GitSummary(self.path, signature)
+
+    def is_stale(self):
+        #Changes to the repo happen in .git, which isn't watched.  But update() is cheap if nothing changed.
+        return True
+
+#Code summaries show the signatures of definitions to some depth, or, at full_code_depth, the full code.
+full_code_depth = 3
 
 class CodeSummary(Summary):
     def __init__(self, path, depth):
+        self.watch(path)
         path.assert_valid_code()
         self.path = path
         self.depth = depth
 
-        self.treesitter_ast = path.treesitter_ast()
-        if depth <= 3:
-            self.contents = self.treesitter_ast.code
+        #Don't keep the parse, so summaries are cheap to send back from a process pool.
+        ast = path.treesitter_ast()
+        if full_code_depth <= depth:
+            self.contents = ast.code
+            self.parts = code_parts(path, ast)
         else:
-            self.contents = self.treesitter_ast.summarize(depth)
+            self.contents = ast.summarize(depth)
+            self.parts = signature_parts(path, ast, depth)
 
     def new_message(self):
         return f'<file, path={self.path}>\n{self.contents}\n</file>'
 
     def update_message(self, prev_summary):
-        return f'<file, path={self.path}>\n{self.contents}\n</file>'
+        """
+        Only describes the functions/classes that were added, removed or modified,
+        unless that'd be longer than just sending the whole file again.
+        """
+        result = [f'<file_update, path={self.path}>']
+        for part, text in self.parts.items():
+            if part not in prev_summary.parts:
+                result.append(f'<added path={part}>\n{text}\n</added>')
+            elif text != prev_summary.parts[part]:
+                diff = line_diff(prev_summary.parts[part], text)
+                result.append(f'<modified path={part}>\n{diff}\n</modified>')
+        for part in prev_summary.parts:
+            if part not in self.parts:
+                result.append(f'<removed path={part}/>')
+        result.append('</file_update>')
+        result = '\n'.join(result)
+
+        new_message = self.new_message()
+        return new_message if len(new_message) <= len(result) else result
 
     def update(self):
         return CodeSummary(self.path, self.depth)
         #returns a new summary, based on the path and depth
 
+def code_parts(path, ast):
+    """
+    Splits the code for ast into its children.  Any other lines (e.g. the signature of a class)
+    form the part for ast itself.
+    Returns a dict mapping FullPath -> code.
+    """
+    result = {}
+    own_lines = []
+    line = ast.start_line
+    for name, child in ast.children.items():
+        own_lines.append(ast.source.lines(line, child.start_line))
+        result[path.append_part(name)] = child.code
+        line = child.end_line
+    own_lines.append(ast.source.lines(line, ast.end_line))
+
+    own_code = '\n'.join(lines for lines in own_lines if lines.strip())
+    if own_code:
+        result = {path: own_code, **result}
+    return result
+
+def signature_parts(path, ast, depth):
+    """
+    The signature of every function/class included in ast.summarize(depth).
+    Returns a dict mapping FullPath -> signature.
+    """
+    result = {}
+    if ast.signature is not None:
+        result[path] = ast.signature
+    if 0 < depth:
+        for name, child in ast.children.items():
+            result.update(signature_parts(path.append_part(name), child, depth-1))
+    return result
+
+def line_diff(original:str, updated:str):
+    """
+    Unified diff, with one line of context, and without the file headers.
+    """
+    diff = difflib.unified_diff(original.split('\n'), updated.split('\n'), lineterm='', n=1)
+    return '\n'.join(line for line in diff if not line.startswith(('---', '+++')))
+
 def file_list_update_message(path, original_filenames:str, updated_filenames:str):
     """
     Takes two lists of filenames, as a single string with newlines between filenames, and returns changes.
@@ -135,7 +260,7 @@ def new_summaries_from_token_sources(sources: Sources) -> SummaryDict:
     #Gather all new sources.
     result_list = []
     for source_path, source_max_tokens in sources:
-        result_list = result_list + new_summaries_from_token_source(source_path, source_max_tokens)
+        result_list.extend(new_summaries_from_token_source(source_path, source_max_tokens))
 
     #Could be duplicates because this takes multiple sources.  De-duplicate.
     result_dict = {} 
@@ -143,59 +268,155 @@ def new_summaries_from_token_sources(sources: Sources) -> SummaryDict:
         insert = True
         if (path in result_dict) and isinstance(summary, CodeSummary):
             prev_summary = result_dict[path]
-            if prev_summary.depth > depth:
+            if prev_summary.depth > summary.depth:
                 insert = False
         if insert:
             result_dict[path] = summary
 
     return result_dict
 
+#### Best-first summaries.
+#### Candidates are summaries we could add: a directory listing, a deeper summary of a file or a
+#### function/class, or the full code of a function/class.  We repeatedly add the candidate with the
+#### most value per token that still fits.  Value decays with each level below the source.
+value_decay = 0.5
+
 def new_summaries_from_token_source(path: FullPath, max_tokens:int) -> SummaryList:
     """
-    Try summaries of different depths, measuring the number of tokens they produce.
-    Once they produce too many tokens, use the previous depth.
+    The summary of path itself is always included, even if it uses more than max_tokens.
+    """
+    summaries = {}      # FullPath -> Summary, in the order they were first added.
+    candidates = []     # Heap of (-value per token, tiebreak, level, summary).
+    tiebreak = itertools.count()
+
+    def extra_tokens(summary):
+        prev_summary = summaries.get(summary.path)
+        return summary.tokens() - (0 if prev_summary is None else prev_summary.tokens())
+
+    def push(summary, level):
+        value = value_decay ** level
+        heapq.heappush(candidates, (-value / max(extra_tokens(summary), 1), next(tiebreak), level, summary))
+
+    def add(summary, level):
+        summaries[summary.path] = summary
+        if isinstance(summary, DirSummary):
+            for child_path in summary.path.iter_tracked():
+                child_summary = first_summary(child_path)
+                if child_summary is not None:
+                    push(child_summary, level+1)
+        elif summary.depth < full_code_depth:
+            push(CodeSummary(summary.path, summary.depth+1), level+1)
+            if summary.depth == 1:
+                #Allows the full code of one function, without the full code for the rest of the file.
+                for child_path in summary.path.iter_tracked():
+                    push(CodeSummary(child_path, full_code_depth), level+1)
+
+    path.assert_is_valid()
+    root = first_summary(path)
+    assert root is not None
+    tokens = root.tokens()
+    add(root, 0)
+
+    while candidates:
+        _, _, level, summary = heapq.heappop(candidates)
+        prev_summary = summaries.get(summary.path)
+        if prev_summary is not None and not (isinstance(summary, CodeSummary) and prev_summary.depth < summary.depth):
+            #Already have this (or something deeper).
+            continue
+        extra = extra_tokens(summary)
+        if tokens + extra <= max_tokens:
+            tokens += extra
+            add(summary, level)
+
+    #Drop functions/classes that are already included in the full code of a file or class.
+    full_code = [path for (path, summary) in summaries.items() if isinstance(summary, CodeSummary) and full_code_depth <= summary.depth]
+    return [(path, summary) for (path, summary) in summaries.items() if not any(path != outer and path.is_in(outer) for outer in full_code)]
+
+def first_summary(path: FullPath) -> Summary:
+    """
+    None if path isn't a directory or valid code (e.g. it's a binary file).
     """
-    prev_summaries = new_summaries_from_depth(path, depth=1)
-    for depth in range(1, 4): #1,2,3
-        summaries = new_summaries_from_depth(path, depth)
+    if path.is_valid_code():
+        return CodeSummary(path, 1)
+    elif path.is_valid_dir():
+        return DirSummary(path)
+    else:
+        return None
 
-        summary_tokens = sum(summary.tokens() for (path, summary) in summaries)
-        if max_tokens < summary_tokens:
-            break
 
-        prev_summaries = summaries
 
-    return prev_summaries
+#### Pool for refreshing stale summaries in parallel, e.g. after a `git checkout` changes many files.
+#### Only used when there are at least pool_min_summaries stale summaries.
+pool = None
+pool_min_summaries = 16
 
-def new_summaries_from_depth(path: FullPath, depth:int) -> SummaryList:
-    path.assert_is_valid()
-    assert 1 <= depth 
+def set_pool(_pool):
+    global pool
+    pool = _pool
 
-    if path.is_valid_code():
-        result = [(path, CodeSummary(path, depth))]
-    else:
-        assert path.is_valid_dir()
-        result = [(path, DirSummary(path))]
-        if 2 <= depth:
-            for child_path in path.iter_tracked():
-                result = result + new_summaries_from_depth(child_path, depth-1)
+def init_process_worker():
+    #Workers don't watch paths; the main process already watches the paths of the summaries.
+    set_watcher(None)
+    #Workers can't share the main process's persistent cache (they'd overwrite its index).
+    set_persistent_cache(None)
 
-    return result
+def make_pool(kind, workers=None):
+    """
+    kind is 'thread' or 'process'.  Threads share the parse caches with the main process,
+    so later explores/searches reuse the parses.  Processes parse in parallel, but their
+    parses are thrown away with the worker.
+    """
+    if kind == 'thread':
+        return ThreadPoolExecutor(workers)
+    elif kind == 'process':
+        return ProcessPoolExecutor(workers, initializer=init_process_worker)
+    else:
+        raise ValueError(f"Unknown pool kind {kind}")
 
+def refresh_summary(summary):
+    """
+    Returns (updated_summary, message), where updated_summary is None if the summary is now invalid,
+    and message is None if nothing changed.
+    """
+    try:
+        updated_summary = summary.update()
+    except AgentException as e:
+        return (None, "Previous summary invalid. " + str(e))
 
+    message = None
+    if summary.contents != updated_summary.contents:
+        message = updated_summary.update_message(summary)
+    return (updated_summary, message)
 
 def update_delete_summaries(summaries: SummaryDict) -> (SummaryDict, Messages):
+    if watcher is not None:
+        seq = watcher.poll()
+
+    stale = [(full_path, summary) for (full_path, summary) in summaries.items() if summary.is_stale()]
+    stale_summaries = [summary for (_, summary) in stale]
+    if pool is not None and pool_min_summaries <= len(stale):
+        #chunksize is ignored by threads.
+        refreshed = pool.map(refresh_summary, stale_summaries, chunksize=4)
+    else:
+        refreshed = map(refresh_summary, stale_summaries)
+    refreshed = dict(zip((full_path for (full_path, _) in stale), refreshed))
+
+    #Merge in the original order, so the results don't depend on which worker finished first.
     updated_summaries = {}
     messages = []
-
     for full_path, summary in summaries.items():
-        try:
-            updated_summary = summary.update()
-            if summary.contents != updated_summary.contents:
-                messages.append(updated_summary.update_message(summary))
+        if full_path not in refreshed:
+            updated_summaries[full_path] = summary
+            continue
+
+        updated_summary, message = refreshed[full_path]
+        if updated_summary is not None:
+            if watcher is not None:
+                #Summaries from worker processes don't know the sequence number.
+                updated_summary.seq = seq
             updated_summaries[full_path] = updated_summary
-        except AgentException as e:
-            messages.append("Previous summary invalid. " + str(e))
+        if message is not None:
+            messages.append(message)
 
     return (updated_summaries, messages)
 
@@ -238,6 +459,19 @@ def add_summaries_from_token_sources(prev_summaries:SummaryDict, sources: List[T
     summaries, messages = add_summaries(prev_summaries, new_summaries)
     return summaries, messages + invalid_messages
 
+def add_git_summary(prev_summaries:SummaryDict, path:FullPath) -> (SummaryDict, Messages):
+    """
+    path can be the repo, or its .git directory.
+    """
+    if path.path.name != '.git':
+        path = path.append_path('.git')
+
+    try:
+        summary = GitSummary(path)
+    except AgentException as e:
+        return prev_summaries, [str(e)]
+    return add_summaries(prev_summaries, {path: summary})
+
 
 #fp = full_path('src/')
 #ns, ms = update_summaries_from_token_sources({}, [(fp, 10000)])
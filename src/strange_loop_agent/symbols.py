@@ -0,0 +1,224 @@
+"""
+Index of the definitions (functions, classes, methods etc.) in every tracked file
+under the root (usually the directory the agent was started in), so the agent can
+find where something is defined, or what calls what, without grepping.
+
+The index maps each file to the definitions in it, and the names called from each
+definition.  It also maps each name to the places it's defined, and the definitions
+that call it, so lookups are a dict lookup.  It's saved in the hash directory, and
+updated incrementally (see file_index.py), so at the first lookup in a session, we
+only reparse files that changed since the index was saved.
+"""
+
+import os
+import json
+from pathlib import Path
+
+from .FullPath import FullPath, is_utf8, treesitter_file_ast
+from .treesitter import language_for_path, call_sites
+from .file_index import FileIndex
+from .exceptions import AgentException
+
+SYMBOLS_VERSION = 2
+
+def index_file(path:Path):
+    """
+    Returns a dict with:
+      symbols: a list of [parts, name, signature] for every definition in the file.
+               parts can differ from the name for repeated definitions (see treesitter.unique_name).
+      calls:   a list of [parts, name] for every function/method called in the definition at parts,
+               where parts is [] for calls outside any definition.  Calls in nested definitions
+               are only recorded for the innermost definition.
+    """
+    if language_for_path(path) is None or not is_utf8(path):
+        return {'symbols': [], 'calls': []}
+    #Shares the parse with summaries, explore etc., and the persistent cache.
+    ast = treesitter_file_ast(path)
+
+    symbols = []
+    definitions = []    #(start_byte, end_byte, parts), in order of start_byte.
+    def add_children(node, parts):
+        for key, child in node.children.items():
+            #Code blocks have an empty signature, and aren't definitions.
+            if child.signature:
+                child_parts = [*parts, key]
+                symbols.append([child_parts, child.name or key, child.signature])
+                definitions.append((child.start_byte, child.end_byte, child_parts))
+                add_children(child, child_parts)
+    add_children(ast, [])
+
+    #Sweep through the calls and definitions in order, keeping a stack of the definitions we're inside.
+    calls = {}
+    stack = []
+    i = 0
+    for start_byte, name in call_sites(ast):
+        while i < len(definitions) and definitions[i][0] <= start_byte:
+            while stack and stack[-1][1] <= definitions[i][0]:
+                stack.pop()
+            stack.append(definitions[i])
+            i += 1
+        while stack and stack[-1][1] <= start_byte:
+            stack.pop()
+        parts = stack[-1][2] if stack else []
+        calls[(tuple(parts), name)] = None
+    return {'symbols': symbols, 'calls': [[list(parts), name] for (parts, name) in calls]}
+
+def remove(index, name, value):
+    """
+    Removes value from the collection at index[name], removing name if that leaves it empty.
+    """
+    values = index[name]
+    if isinstance(values, dict):
+        del values[value]
+    else:
+        values.discard(value)
+    if not values:
+        del index[name]
+
+class SymbolIndex(FileIndex):
+    def __init__(self, hash_dir, root, watcher=None):
+        super().__init__(root, watcher)
+        self.index_path = Path(hash_dir) / f'symbols_v{SYMBOLS_VERSION}.json'
+        self.names = {}             # name -> {(str(path), parts): signature}
+        self.callers = {}           # name -> {(str(path), parts) that call name}
+        self.files = self.load()    # str(path) -> {'mtime', 'size', 'symbols', 'calls'}
+        for key, entry in self.files.items():
+            self.add_entry(key, entry)
+
+    def load(self):
+        try:
+            with self.index_path.open('r') as file:
+                return json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def flush(self):
+        #If a (background) refresh is still running at exit, don't wait for it.
+        #Files it indexed are reparsed next session, but they're in the persistent cache by then.
+        if not self.lock.acquire(blocking=False):
+            return
+        try:
+            if self.dirty:
+                tmp_path = self.index_path.with_suffix('.tmp')
+                with tmp_path.open('w') as file:
+                    json.dump(self.files, file)
+                os.replace(tmp_path, self.index_path)
+                self.dirty = False
+        finally:
+            self.lock.release()
+
+    #### Keeping names and callers consistent with the files.
+    def index_file(self, path:Path):
+        return index_file(path)
+
+    def add_entry(self, key, entry):
+        for parts, name, signature in entry['symbols']:
+            self.names.setdefault(name, {})[(key, tuple(parts))] = signature
+        for parts, name in entry['calls']:
+            self.callers.setdefault(name, set()).add((key, tuple(parts)))
+
+    def remove_entry(self, key, entry):
+        for parts, name, _ in entry['symbols']:
+            remove(self.names, name, (key, tuple(parts)))
+        for parts, name in entry['calls']:
+            remove(self.callers, name, (key, tuple(parts)))
+
+    #### Lookups.
+    def find(self, name):
+        """
+        Returns a list of (FullPath, signature) for every definition of name.
+        """
+        self.refresh()
+        matches = self.names.get(name, {})
+        return [(FullPath(Path(key), *parts), signature) for ((key, parts), signature) in sorted(matches.items())]
+
+    def name_of(self, path:FullPath):
+        """
+        The name of the definition at path (which can differ from the last part, for repeated definitions).
+        """
+        key = str(path.path)
+        for parts, name, _ in self.files.get(key, {'symbols': []})['symbols']:
+            if tuple(parts) == path.parts:
+                return name
+        raise AgentException(f"No definition found at {path}")
+
+    def signature(self, key, parts):
+        if len(parts) == 0:
+            return ''
+        for symbol_parts, _, signature in self.files[key]['symbols']:
+            if tuple(symbol_parts) == parts:
+                return signature
+
+    def find_callers(self, path:FullPath):
+        """
+        Returns a list of (FullPath, signature) for every definition that calls the function/method at path.
+        """
+        self.refresh()
+        callers = self.callers.get(self.name_of(path), set())
+        return [(FullPath(Path(key), *parts), self.signature(key, parts)) for (key, parts) in sorted(callers)]
+
+    def find_callees(self, path:FullPath):
+        """
+        Returns (definitions, unresolved), where definitions is a list of (FullPath, signature)
+        for every definition that might be called from path (or anything nested inside it),
+        and unresolved is the names called that aren't defined in any tracked file (e.g. builtins).
+        """
+        self.refresh()
+        key = str(path.path)
+        if key not in self.files:
+            raise AgentException(f"{path} isn't a tracked file")
+        names = {}
+        for parts, name in self.files[key]['calls']:
+            if tuple(parts[:len(path.parts)]) == path.parts:
+                names[name] = None
+
+        definitions = []
+        unresolved = []
+        for name in names:
+            matches = self.names.get(name, {})
+            if matches:
+                definitions.extend((FullPath(Path(k), *parts), signature) for ((k, parts), signature) in sorted(matches.items()))
+            else:
+                unresolved.append(name)
+        return definitions, unresolved
+
+
+#### Shared index, set up in initialize_state.
+symbol_index = None
+max_symbols = 50
+
+def set_symbol_index(index):
+    global symbol_index
+    symbol_index = index
+
+def definitions_message(matches):
+    lines = [f'{path}: {signature}' for (path, signature) in matches[:max_symbols]]
+    if max_symbols < len(matches):
+        lines.append(f'... and {len(matches) - max_symbols} more')
+    return lines
+
+def find_symbol_message(name):
+    matches = symbol_index.find(name)
+    lines = definitions_message(matches)
+    if not matches:
+        lines.append(f'No definitions of {name} found.')
+    lines = '\n'.join(lines)
+    return f'<symbols name={name}>\n{lines}\n</symbols>'
+
+def callers_message(path:FullPath):
+    matches = symbol_index.find_callers(path)
+    lines = definitions_message(matches)
+    if not matches:
+        lines.append(f'No calls to {path} found.')
+    lines = '\n'.join(lines)
+    return f'<callers path={path}>\n{lines}\n</callers>'
+
+def callees_message(path:FullPath):
+    matches, unresolved = symbol_index.find_callees(path)
+    lines = definitions_message(matches)
+    if unresolved:
+        lines.append('Not defined in any tracked file: ' + ', '.join(unresolved))
+    if not (matches or unresolved):
+        lines.append(f'No calls found in {path}.')
+    lines = '\n'.join(lines)
+    return f'<callees path={path}>\n{lines}\n</callees>'
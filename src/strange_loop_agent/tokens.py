@@ -0,0 +1,76 @@
+"""
+Counting tokens, e.g. to keep summaries within a budget.
+
+The default counter approximates a BPE tokenizer without needing the network
+(or the tokenizer files).  Like BPE tokenizers, it first splits text into words,
+numbers, runs of punctuation and runs of whitespace, then estimates the tokens
+in each piece:
+  common words are usually one token, but long identifiers are split,
+  numbers are split into groups of three digits,
+  punctuation (which is common in code) mostly gets a token per character,
+  non-ASCII text mostly gets a token per character (or more, for e.g. emoji).
+
+Counts are memoized by the hash of the text, so the summarizer, and anything
+else that needs a count, can ask repeatedly for the same text cheaply.
+
+For now, the only caller is Summary.tokens, for the summary budgets.  The agent
+doesn't trim messages to fit the context, and the explore confirmation just lists
+the paths, so neither has a size estimate to replace.  Either should use count_tokens
+if it's added.
+"""
+
+import re
+import hashlib
+
+from .cache import LRUCache
+
+class TokenCounter():
+    def count(self, text:str) -> int:
+        raise NotImplementedError()
+
+pretokenize = re.compile(r"""'(?:s|t|re|ve|m|ll|d)| ?[^\W\d_]+| ?\d+| ?[^\s\w]+|\s+""")
+
+class ApproximateBPECounter(TokenCounter):
+    def __init__(self, chars_per_word_token=6, chars_per_symbol_token=1.5):
+        self.chars_per_word_token = chars_per_word_token
+        self.chars_per_symbol_token = chars_per_symbol_token
+
+    def count(self, text:str) -> int:
+        if not text.isascii():
+            #Count each non-ASCII character separately, with characters that take more bytes
+            #(e.g. emoji) taking more tokens.
+            ascii_text = text.encode('ascii', errors='ignore').decode('ascii')
+            non_ascii_bytes = len(text.encode('utf8')) - len(ascii_text)
+            return self.count(ascii_text) + -(-non_ascii_bytes // 3)
+
+        result = 0
+        for piece in pretokenize.findall(text):
+            first = piece.lstrip(' ')[:1]
+            if piece.isspace():
+                #Indentation is usually merged, but each newline is a token.
+                result += max(1, piece.count('\n'))
+            elif first.isdigit():
+                result += -(-len(piece.strip()) // 3)
+            elif first.isalpha() or first == "'":
+                result += -(-len(piece) // self.chars_per_word_token)
+            else:
+                result += max(1, round(len(piece.strip()) / self.chars_per_symbol_token))
+        return result
+
+
+#### Shared counter, with counts memoized by the hash of the text.
+token_counter = ApproximateBPECounter()
+token_counts = LRUCache(100000)
+
+def set_token_counter(counter:TokenCounter):
+    global token_counter
+    token_counter = counter
+    token_counts.clear()
+
+def count_tokens(text:str) -> int:
+    key = hashlib.blake2b(text.encode('utf8', errors='surrogatepass'), digest_size=16).digest()
+    result = token_counts.get(key)
+    if result is None:
+        result = token_counter.count(text)
+        token_counts[key] = result
+    return result
@@ -4,6 +4,9 @@ import subprocess
 from dataclasses import replace
 
 from .check_command import check_command
+from .symbols import find_symbol_message, callers_message, callees_message
+from .search import search_message
+from .FullPath import full_path
 
 from .exceptions import AgentException
 
@@ -95,33 +98,164 @@ tools_internal["explore"] = {
 
 
 
-#def report_git_ls_files(path):
-#    return f"About to a git repo at: {path}"
-#
-#def git_ls_files(state, path):
-#    return not_implemented
-#
-#def check_git_ls_files(state, paths):
-#    pass
-#
-#tools_internal["git_ls_files"] = {
-#    "function" : git_ls_files,
-#    "report_function": report_git_ls_files,
-#    "check_function": check_git_ls_files,
-#    "description" : "Prints all the files in the git repo at path.",
-#    "input_schema" : {
-#        "type": "object",
-#        "properties": {
-#            "command": {
-#                "type": "string",
-#                "description": "The path to the git repo.",
-#            },
-#        },
-#        "required": ["path"],
-#    },
-#}
-#
-#
+def report_find_symbol(name):
+    return f"About to find definitions of: {name}"
+
+def find_symbol(state, name):
+    return state, find_symbol_message(name)
+
+def check_find_symbol(state, name):
+    pass
+
+tools_internal["find_symbol"] = {
+    "function" : find_symbol,
+    "report_function": report_find_symbol,
+    "check_function": check_find_symbol,
+    "description" : "Finds where a function, class or method is defined, in any tracked file in the current directory.  Prints the path to each definition (which can be passed to explore), along with its signature.  Much faster than using grep.",
+    "input_schema" : {
+        "type": "object",
+        "properties": {
+            "name": {
+                "type": "string",
+                "description": "The name of the function, class or method (without any class name or path).",
+            },
+        },
+        "required": ["name"],
+    },
+}
+
+
+
+
+
+
+def report_search(query, max_results=50):
+    return f"About to search for: {query}"
+
+def search(state, query, max_results=50):
+    return state, search_message(query, max_results)
+
+def check_search(state, query, max_results=50):
+    if not query:
+        raise AgentException("Can't search for an empty string.")
+    if max_results < 1:
+        raise AgentException("max_results must be at least 1.")
+
+tools_internal["search"] = {
+    "function" : search,
+    "report_function": report_search,
+    "check_function": check_search,
+    "description" : "Searches every tracked file in the current directory for a string (not a regex), like grep -rF, but much faster.  Prints the path to the function/class containing each match (which can be passed to explore), along with the line number in the file, and the line.",
+    "input_schema" : {
+        "type": "object",
+        "properties": {
+            "query": {
+                "type": "string",
+                "description": "The string to search for.",
+            },
+            "max_results": {
+                "type": "integer",
+                "description": "The maximum number of matches to print (default 50).",
+            },
+        },
+        "required": ["query"],
+    },
+}
+
+
+
+
+
+
+def report_explore_callers(path):
+    return f"About to find everything that calls: {path}"
+
+def explore_callers(state, path):
+    return state, callers_message(full_path(path))
+
+def check_explore_callers(state, path):
+    pass
+
+tools_internal["explore_callers"] = {
+    "function" : explore_callers,
+    "report_function": report_explore_callers,
+    "check_function": check_explore_callers,
+    "description" : "Finds every function/method (in any tracked file in the current directory) that calls the function or method at path.  Calls are matched by name, so there may be false positives, e.g. from methods with the same name on different classes.",
+    "input_schema" : {
+        "type": "object",
+        "properties": {
+            "path": {
+                "type": "string",
+                "description": "The path to the function /path/to/file#function_name, or method /path/to/file#class_name#method_name.",
+            },
+        },
+        "required": ["path"],
+    },
+}
+
+
+
+
+
+
+def report_explore_callees(path):
+    return f"About to find everything called by: {path}"
+
+def explore_callees(state, path):
+    return state, callees_message(full_path(path))
+
+def check_explore_callees(state, path):
+    pass
+
+tools_internal["explore_callees"] = {
+    "function" : explore_callees,
+    "report_function": report_explore_callees,
+    "check_function": check_explore_callees,
+    "description" : "Finds the definitions of every function/method called from path (including from any functions/methods nested in path).  Calls are matched by name, so there may be false positives.",
+    "input_schema" : {
+        "type": "object",
+        "properties": {
+            "path": {
+                "type": "string",
+                "description": "The path to a file /path/to/file, function /path/to/file#function_name, class /path/to/file#class_name or method /path/to/file#class_name#method_name.",
+            },
+        },
+        "required": ["path"],
+    },
+}
+
+
+
+
+
+
+def report_git_ls_files(path):
+    return f"About to list the files in the git repo at: {path}"
+
+def git_ls_files(state, path):
+    return state.add_git_summary(path)
+
+def check_git_ls_files(state, path):
+    pass
+
+tools_internal["git_ls_files"] = {
+    "function" : git_ls_files,
+    "report_function": report_git_ls_files,
+    "check_function": check_git_ls_files,
+    "description" : "Prints all the files tracked by the git repo at path.",
+    "input_schema" : {
+        "type": "object",
+        "properties": {
+            "path": {
+                "type": "string",
+                "description": "The path to the git repo.",
+            },
+        },
+        "required": ["path"],
+    },
+}
+
+
 #def report_ls(path):
 #    return f"About to print a directory at: {path}"
 #
@@ -1,27 +1,155 @@
 """
 Uses tree sitter to split code files into blocks
+
+The TreeSitterAST for a file is built lazily.  The children of a node are only found
+when they're first needed (e.g. by summarize, exists or index), using the
+tree_sitter.Tree that is kept alongside the code in SourceCode.
 """
 
+import re
 import math
+import threading
+from array import array
+from itertools import accumulate
 from tree_sitter import Language, Parser
 from tree_sitter_languages import get_language, get_parser
 from typing import Dict, List
 from dataclasses import dataclass, field
 from pathlib import Path
 
+from .detect_language import EXTENSION_TO_LANGUAGE
+
+class SourceCode:
+    """
+    The code for a whole file, shared by all the TreeSitterAST nodes for that file.
+    Nodes just record line numbers, and the code for a node is only sliced out when needed.
+    nodes counts the TreeSitterAST nodes built on the source so far, so the memory used by
+    a lazily built parse can be found without walking it.
+
+    Parses are shared between threads (e.g. summaries refreshed in a thread pool), so lock
+    guards the tree, and the nodes found from it.
+    """
+    __slots__ = ('code', 'line_offsets', 'language', 'tree', 'nodes', 'lock')
+
+    def __init__(self, code, language=None, tree=None):
+        assert isinstance(code, str)
+        self.code = code
+        #Offset of the start of each line, plus one past the end of the code (as if it ended in a newline).
+        self.line_offsets = array('q', accumulate((len(line)+1 for line in code.split('\n')), initial=0))
+        self.language = language
+        self.tree = tree
+        self.nodes = 0
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        """
+        Number of lines.
+        """
+        return len(self.line_offsets) - 1
+
+    def lines(self, start_line, end_line):
+        """
+        Same as '\n'.join(code.split('\n')[start_line:end_line]), without splitting.
+        """
+        end_line = min(end_line, len(self))
+        if end_line <= start_line:
+            return ''
+        return self.code[self.line_offsets[start_line]:self.line_offsets[end_line]-1]
+
+    def line(self, line):
+        return self.lines(line, line+1)
+
+    def syntax_tree(self):
+        """
+        The tree_sitter.Tree for the code.  Reparses if the tree has been dropped
+        (after pickling, or after the tree was reused for an incremental reparse).
+        """
+        with self.lock:
+            if self.tree is None:
+                self.tree = parser_for(self.language).parse(bytes(self.code, "utf8"))
+            return self.tree
+
+    def nbytes(self):
+        """
+        Approximate memory used by the source, along with all the nodes built on it.
+        """
+        result = len(self.code) + self.line_offsets.itemsize * len(self.line_offsets) + 200 * self.nodes
+        if self.tree is not None:
+            #A tree takes considerably more memory than the code.
+            result += 10 * len(self.code)
+        return result
+
+    def __getstate__(self):
+        #Trees and locks can't be pickled.
+        return (self.code, self.line_offsets, self.language, self.nodes)
+
+    def __setstate__(self, state):
+        self.code, self.line_offsets, self.language, self.nodes = state
+        self.tree = None
+        self.lock = threading.RLock()
+
 class TreeSitterAST:
-    def __init__(self, signature, start_line, end_line, code, children):
+    __slots__ = ('signature', 'start_line', 'end_line', 'source', '_children', 'name', 'start_byte', 'end_byte', 'pending')
+
+    def __init__(self, signature, start_line, end_line, source, children, name=None, start_byte=None, end_byte=None, pending=None):
+        """
+        children is None if the children haven't been found yet.
+        start_byte and end_byte locate definitions in the tree.
+        pending is an optional list of all the Definition's nested inside this one, if we already know them.
+        """
         assert isinstance(signature, (str, type(None)))
         assert isinstance(start_line, int)
         assert isinstance(end_line, int)
-        assert isinstance(code, str)
-        assert isinstance(children, dict)
+        assert isinstance(source, SourceCode)
+        assert isinstance(children, (dict, type(None)))
 
         self.signature = signature
         self.start_line = start_line
         self.end_line = end_line
-        self.code = code
-        self.children = children
+        self.source = source
+        self._children = children
+        #The name of the definition, before de-duplication (None for files and code blocks).
+        self.name = name
+        self.start_byte = start_byte
+        self.end_byte = end_byte
+        self.pending = pending
+        source.nodes += 1
+
+    @property
+    def children(self):
+        if self._children is None:
+            with self.source.lock:
+                #Another thread may have found the children while we waited.
+                if self._children is None:
+                    self._children = expand(self)
+                    self.pending = None
+        return self._children
+
+    @property
+    def code(self):
+        return self.source.lines(self.start_line, self.end_line)
+
+    def node_count(self):
+        """
+        Number of nodes that have been built so far.
+        """
+        children = {} if self._children is None else self._children
+        return 1 + sum(child.node_count() for child in children.values())
+
+    def nbytes(self):
+        """
+        Approximate memory used by the parse of the whole file (see SourceCode.nbytes).
+        Grows as more of the parse is built.
+        """
+        return self.source.nbytes()
+
+    def __getstate__(self):
+        #Only the nodes built so far are pickled (along with pending, which is just tuples), so pickling
+        #doesn't build the rest.  After unpickling, finding more children reparses the source (see syntax_tree).
+        return (self.signature, self.start_line, self.end_line, self.source, self._children, self.name, self.start_byte, self.end_byte, self.pending)
+
+    def __setstate__(self, state):
+        (self.signature, self.start_line, self.end_line, self.source, self._children, self.name, self.start_byte, self.end_byte, self.pending) = state
 
     def summarize(self, depth, parts=()):
         if self.signature is None:
@@ -66,67 +194,448 @@ class TreeSitterAST:
             return self.children[parts[0]].index(parts[1:])
     
 
-def treesitter_ast_just_function_class(all_code: str):
-    """
-    Uses tree_sitter to extract function and class definitions.
-
-    Line numbers are standard Python (zero based, ranges run from start_line -> end_line+1
-
-    Returns a dict mapping name -> TreeSitterCode Summary (just function and class definitions).
-    """
-    parser = get_parser('python')
-    tree = parser.parse(bytes(all_code, "utf8"))
-    query = get_language('python').query("""
+#### Parsers and queries are expensive to construct, so we build them once per language.
+#Each query captures definitions (functions, classes, structs, impls, interfaces etc.)
+#as @<kind>.def, with the name of the definition as @<kind>.name.
+#Languages are keyed as in detect_language.EXTENSION_TO_LANGUAGE.  Files in other
+#languages aren't parsed, and are just treated as a single code block.
+queries = {
+    'python': """
     (function_definition
       name: (identifier) @function.name) @function.def
     (class_definition
       name: (identifier) @class.name) @class.def
-    """)
-    
-    all_code_lines = all_code.split('\n')
+    """,
+    'javascript': """
+    (function_declaration
+      name: (identifier) @function.name) @function.def
+    (generator_function_declaration
+      name: (identifier) @function.name) @function.def
+    (class_declaration
+      name: (identifier) @class.name) @class.def
+    (method_definition
+      name: (property_identifier) @method.name) @method.def
+    (variable_declarator
+      name: (identifier) @function.name
+      value: [(arrow_function) (function)]) @function.def
+    """,
+    'typescript': """
+    (function_declaration
+      name: (identifier) @function.name) @function.def
+    (generator_function_declaration
+      name: (identifier) @function.name) @function.def
+    (class_declaration
+      name: (type_identifier) @class.name) @class.def
+    (abstract_class_declaration
+      name: (type_identifier) @class.name) @class.def
+    (interface_declaration
+      name: (type_identifier) @interface.name) @interface.def
+    (enum_declaration
+      name: (identifier) @enum.name) @enum.def
+    (method_definition
+      name: (property_identifier) @method.name) @method.def
+    (variable_declarator
+      name: (identifier) @function.name
+      value: [(arrow_function) (function)]) @function.def
+    """,
+    'java': """
+    (class_declaration
+      name: (identifier) @class.name) @class.def
+    (interface_declaration
+      name: (identifier) @interface.name) @interface.def
+    (enum_declaration
+      name: (identifier) @enum.name) @enum.def
+    (record_declaration
+      name: (identifier) @class.name) @class.def
+    (method_declaration
+      name: (identifier) @method.name) @method.def
+    (constructor_declaration
+      name: (identifier) @method.name) @method.def
+    """,
+    'c': """
+    (function_definition
+      declarator: (function_declarator
+        declarator: (identifier) @function.name)) @function.def
+    (function_definition
+      declarator: (pointer_declarator
+        declarator: (function_declarator
+          declarator: (identifier) @function.name))) @function.def
+    (struct_specifier
+      name: (type_identifier) @struct.name
+      body: (field_declaration_list)) @struct.def
+    """,
+    'cpp': """
+    (function_definition
+      declarator: (function_declarator
+        declarator: [(identifier) (field_identifier) (qualified_identifier) (destructor_name) (operator_name)] @function.name)) @function.def
+    (function_definition
+      declarator: (pointer_declarator
+        declarator: (function_declarator
+          declarator: [(identifier) (field_identifier) (qualified_identifier)] @function.name))) @function.def
+    (function_definition
+      declarator: (reference_declarator
+        (function_declarator
+          declarator: [(identifier) (field_identifier) (qualified_identifier) (operator_name)] @function.name))) @function.def
+    (class_specifier
+      name: (type_identifier) @class.name
+      body: (field_declaration_list)) @class.def
+    (struct_specifier
+      name: (type_identifier) @struct.name
+      body: (field_declaration_list)) @struct.def
+    (namespace_definition
+      name: (namespace_identifier) @namespace.name) @namespace.def
+    """,
+    'c_sharp': """
+    (namespace_declaration
+      name: [(identifier) (qualified_name)] @namespace.name) @namespace.def
+    (class_declaration
+      name: (identifier) @class.name) @class.def
+    (interface_declaration
+      name: (identifier) @interface.name) @interface.def
+    (struct_declaration
+      name: (identifier) @struct.name) @struct.def
+    (enum_declaration
+      name: (identifier) @enum.name) @enum.def
+    (record_declaration
+      name: (identifier) @class.name) @class.def
+    (method_declaration
+      name: (identifier) @method.name) @method.def
+    (constructor_declaration
+      name: (identifier) @method.name) @method.def
+    """,
+    'ruby': """
+    (module
+      name: (constant) @module.name) @module.def
+    (class
+      name: (constant) @class.name) @class.def
+    (method
+      name: (_) @method.name) @method.def
+    (singleton_method
+      name: (_) @method.name) @method.def
+    """,
+    'go': """
+    (function_declaration
+      name: (identifier) @function.name) @function.def
+    (method_declaration
+      name: (field_identifier) @method.name) @method.def
+    (type_spec
+      name: (type_identifier) @type.name
+      type: [(struct_type) (interface_type)]) @type.def
+    """,
+    'rust': """
+    (function_item
+      name: (identifier) @function.name) @function.def
+    (struct_item
+      name: (type_identifier) @struct.name) @struct.def
+    (enum_item
+      name: (type_identifier) @enum.name) @enum.def
+    (trait_item
+      name: (type_identifier) @trait.name) @trait.def
+    (impl_item
+      type: (type_identifier) @impl.name) @impl.def
+    (impl_item
+      type: (generic_type
+        type: (type_identifier) @impl.name)) @impl.def
+    (mod_item
+      name: (identifier) @module.name
+      body: (declaration_list)) @module.def
+    """,
+    'php': """
+    (function_definition
+      name: (name) @function.name) @function.def
+    (class_declaration
+      name: (name) @class.name) @class.def
+    (interface_declaration
+      name: (name) @interface.name) @interface.def
+    (trait_declaration
+      name: (name) @trait.name) @trait.def
+    (method_declaration
+      name: (name) @method.name) @method.def
+    """,
+    'kotlin': """
+    (class_declaration
+      name: (type_identifier) @class.name) @class.def
+    (object_declaration
+      name: (type_identifier) @class.name) @class.def
+    (function_declaration
+      name: (simple_identifier) @function.name) @function.def
+    """,
+    'scala': """
+    (class_definition
+      name: (identifier) @class.name) @class.def
+    (object_definition
+      name: (identifier) @class.name) @class.def
+    (trait_definition
+      name: (identifier) @trait.name) @trait.def
+    (function_definition
+      name: (identifier) @function.name) @function.def
+    """,
+    'lua': """
+    (function_definition_statement
+      name: (_) @function.name) @function.def
+    """,
+    'bash': """
+    (function_definition
+      name: (word) @function.name) @function.def
+    """,
+}
+#TSX uses the same node types as typescript.
+queries['tsx'] = queries['typescript']
 
-    module_summary = TreeSitterAST(None, 0, len(all_code_lines), all_code, {})
-    stack = [module_summary]
-    
-    for capture in query.captures(tree.root_node):
-        node, capture_type = capture
-        
-        if capture_type.endswith('.def'):
-            start_line = node.start_point[0]
-            end_line = node.end_point[0] + 1
-
-            code = '\n'.join(all_code_lines[start_line:end_line])
-            signature = all_code_lines[start_line]
-            
-            name_node = next(capture for capture in query.captures(node) if capture[1].endswith('.name'))[0]
-            base_name = name_node.text.decode('utf8')
-
-            #Deals with repeated definitions of the same symbol.
-            i = 1
-            name = base_name
-            while name in stack[-1].children:
-                i += 1
-                name = base_name + str(i)
-            
-            new_summary = TreeSitterAST(signature, start_line, end_line, code, {})
-            
-            while start_line > stack[-1].end_line:
-                stack.pop()
-            
-            stack[-1].children[name] = new_summary
-            stack.append(new_summary)
-    
-    return module_summary
+def language_for_path(path):
+    """
+    Language to use when parsing path, or None if we don't have a query for it.
+    """
+    language = EXTENSION_TO_LANGUAGE.get(Path(path).suffix.lower())
+    return language if language in queries else None
+
+#Parsers can't be used by two threads at once (e.g. summaries refreshed in a thread pool), so each thread has its own.
+thread_parsers = threading.local()
+def parser_for(language):
+    if not hasattr(thread_parsers, 'parsers'):
+        thread_parsers.parsers = {}
+    parsers = thread_parsers.parsers
+    if language not in parsers:
+        parsers[language] = get_parser(language)
+    return parsers[language]
+
+compiled_queries = {}
+def query_for(language):
+    if language not in compiled_queries:
+        compiled_queries[language] = get_language(language).query(queries[language])
+    return compiled_queries[language]
+
+
+def match_to_definition(match):
+    """
+    Extracts (def_node, name_node) from a query match.
+    """
+    def_node = None
+    name_node = None
+    for capture_name, node in match.items():
+        if capture_name.endswith('.def'):
+            def_node = node
+        elif capture_name.endswith('.name'):
+            name_node = node
+    return def_node, name_node
 
-def treesitter_ast_with_other_code_blocks(code: str):
+def definitions(root_node, language):
     """
-    Adds an non-empty code blocks.
+    Yields (def_node, name_node) for every definition under root_node, in order of position in the file.
+
+    Uses a single pass over the matches, as each match gives both the definition and its name.
+    """
+    for _, match in query_for(language).matches(root_node):
+        def_node, name_node = match_to_definition(match)
+        if def_node is not None and name_node is not None:
+            yield def_node, name_node
+
+def outermost_node_types(query):
+    """
+    The node types at the top-level of each pattern in a query, e.g. function_definition.
+    """
+    result = set()
+    depth = 0
+    for token in re.finditer(r'\(\s*([\w.]*)|\)', query):
+        if token.group(0) == ')':
+            depth -= 1
+        else:
+            if depth == 0:
+                result.add(token.group(1))
+            depth += 1
+    return result
+
+definition_types = {}
+def definition_types_for(language):
+    if language not in definition_types:
+        definition_types[language] = outermost_node_types(queries[language])
+    return definition_types[language]
+
+def match_definition(node, language):
+    """
+    If node is a definition, returns its name node, otherwise None.
+
+    The query is restricted to the first byte of node, so it doesn't search the whole subtree.
+    """
+    if node.type not in definition_types_for(language):
+        return None
+    for _, match in query_for(language).matches(node, start_byte=node.start_byte, end_byte=node.start_byte+1):
+        def_node, name_node = match_to_definition(match)
+        if def_node is not None and name_node is not None and same_range(def_node, node):
+            return name_node
+    return None
+
+def same_range(node, other):
+    return node.start_byte == other.start_byte and node.end_byte == other.end_byte
+
+
+#### Call sites, for the call graph (see symbols.py).
+#Each query captures the name of the called function/method/constructor as @call.name.
+#Calls are only matched by name, so e.g. a.f() and b.f() both call f.
+call_queries = {
+    'python': """
+    (call function: [
+      (identifier) @call.name
+      (attribute attribute: (identifier) @call.name)])
+    """,
+    'javascript': """
+    (call_expression function: [
+      (identifier) @call.name
+      (member_expression property: (property_identifier) @call.name)])
+    (new_expression constructor: (identifier) @call.name)
+    """,
+    'go': """
+    (call_expression function: [
+      (identifier) @call.name
+      (selector_expression field: (field_identifier) @call.name)])
+    """,
+    'rust': """
+    (call_expression function: [
+      (identifier) @call.name
+      (field_expression field: (field_identifier) @call.name)
+      (scoped_identifier name: (identifier) @call.name)])
+    (macro_invocation macro: (identifier) @call.name)
+    """,
+    'java': """
+    (method_invocation name: (identifier) @call.name)
+    (object_creation_expression type: (type_identifier) @call.name)
+    """,
+    'c': """
+    (call_expression function: [
+      (identifier) @call.name
+      (field_expression field: (field_identifier) @call.name)])
+    """,
+    'cpp': """
+    (call_expression function: [
+      (identifier) @call.name
+      (field_expression field: (field_identifier) @call.name)
+      (qualified_identifier name: (identifier) @call.name)])
+    """,
+    'ruby': """
+    (call method: (identifier) @call.name)
+    """,
+}
+call_queries['typescript'] = call_queries['javascript']
+call_queries['tsx'] = call_queries['javascript']
+
+compiled_call_queries = {}
+def call_query_for(language):
+    if language not in compiled_call_queries:
+        compiled_call_queries[language] = get_language(language).query(call_queries[language])
+    return compiled_call_queries[language]
+
+def call_sites(ast):
+    """
+    Returns a list of (start_byte, name) for every call in the file parsed as ast, in order.
+    """
+    language = ast.source.language
+    if language not in call_queries:
+        return []
+    with ast.source.lock:
+        root_node = ast.source.syntax_tree().root_node
+        return sorted((node.start_byte, node.text.decode('utf8')) for (node, _) in call_query_for(language).captures(root_node))
+
+
+#### Lazily building the TreeSitterAST.
+#A Definition records everything we need to make a TreeSitterAST node for a definition,
+#without holding on to tree_sitter nodes.
+#(start_byte, end_byte, start_line, end_line, name)
+def definition(def_node, name_node):
+    return (def_node.start_byte, def_node.end_byte, def_node.start_point[0], def_node.end_point[0]+1, name_node.text.decode('utf8'))
+
+def definition_ast(definition, source, pending=None):
+    start_byte, end_byte, start_line, end_line, name = definition
+    return TreeSitterAST(source.line(start_line), start_line, end_line, source, None, name=name, start_byte=start_byte, end_byte=end_byte, pending=pending)
+
+def outermost_definitions(nodes, language):
+    """
+    Definitions in or under the syntax nodes that aren't nested in other definitions.
+
+    Walks the syntax tree, without descending into definitions, so for a file this
+    doesn't have to look inside any function bodies.
+    """
+    result = []
+    stack = [*reversed(nodes)]
+    while 0 < len(stack):
+        node = stack.pop()
+        name_node = match_definition(node, language)
+        if name_node is not None:
+            result.append(definition(node, name_node))
+        else:
+            stack.extend(reversed(node.children))
+    return result
+
+def nested_definitions(ast):
+    """
+    All the Definition's nested inside a definition, in order, from a single pass over the query matches.
+    """
+    source = ast.source
+    root_node = source.syntax_tree().root_node
+    node = root_node.descendant_for_byte_range(ast.start_byte, ast.end_byte)
+    while not (node.start_byte == ast.start_byte and node.end_byte == ast.end_byte and match_definition(node, source.language) is not None):
+        node = node.parent
+    return [definition(d, n) for (d, n) in definitions(node, source.language) if not same_range(d, node)]
+
+def group_definitions(definitions_list, source):
+    """
+    Takes Definition's in order, and makes TreeSitterAST's for the outermost ones.
+    The Definition's nested inside them are kept as pending, so finding their children doesn't need another query.
+    """
+    result = []
+    end_byte = -1
+    for d in definitions_list:
+        if end_byte <= d[0]:
+            result.append(definition_ast(d, source, pending=[]))
+            end_byte = d[1]
+        else:
+            result[-1].pending.append(d)
+    return result
+
+def unique_name(base_name, children):
+    """
+    Deals with repeated definitions of the same symbol.
+    """
+    i = 1
+    name = base_name
+    while name in children:
+        i += 1
+        name = base_name + str(i)
+    return name
+
+def named_children(definition_asts):
+    children = {}
+    for summary in definition_asts:
+        children[unique_name(summary.name, children)] = summary
+    return children
+
+def expand(ast):
+    """
+    Finds the children of a TreeSitterAST node.
+    """
+    source = ast.source
+    if ast.signature == '':
+        #Code block.
+        return {}
+    elif ast.signature is None:
+        #File
+        if source.language is None:
+            return add_other_code_blocks(source, {})
+        definitions_list = outermost_definitions(source.syntax_tree().root_node.children, source.language)
+        return add_other_code_blocks(source, named_children(definition_ast(d, source) for d in definitions_list))
+    else:
+        #Function or class
+        pending = ast.pending
+        if pending is None:
+            pending = nested_definitions(ast)
+        return named_children(group_definitions(pending, source))
+
+def add_other_code_blocks(source, summaries):
+    """
+    Adds an non-empty code blocks between the top-level function/class definitions.
 
     Returns a dict mapping name -> TreeSitterCode Summary (also with blocks)
     """
-    summaries = treesitter_ast_just_function_class(code).children
     summaries_list = [*summaries.items()]
-    lines = code.split('\n')
 
     # Collect the start and end line numbers of every block, where
     # there is a block between every top-level function/class definition.
@@ -136,7 +645,7 @@ def treesitter_ast_with_other_code_blocks(code: str):
         start_line_next_block = func_class.start_line
         block_start_end.append((end_line_prev_block, start_line_next_block))
         end_line_prev_block = func_class.end_line
-    block_start_end.append((end_line_prev_block, len(lines)))
+    block_start_end.append((end_line_prev_block, len(source)))
 
     # Strip any empty lines.
     block_num = 0
@@ -144,11 +653,8 @@ def treesitter_ast_with_other_code_blocks(code: str):
     for i in range(len(block_start_end)):
         start_line, end_line = block_start_end[i]
 
-        lines_between = lines[start_line: end_line]
-
-        if any(0 < len(line.strip()) for line in lines_between):
+        if 0 < len(source.lines(start_line, end_line).strip()):
             block_num = block_num+1
-            code_between = '\n'.join(lines_between)
 
             name = f"%code_block_{block_num}"
 
@@ -156,7 +662,7 @@ def treesitter_ast_with_other_code_blocks(code: str):
                         signature='',
                         start_line=start_line,
                         end_line=end_line,
-                        code=code_between,
+                        source=source,
                         children={}
                     )
 
@@ -164,13 +670,157 @@ def treesitter_ast_with_other_code_blocks(code: str):
             name, summary = summaries_list[i]
             result[name] = summary
 
-    return TreeSitterAST(None, 0, len(code.split('\n')), code, result)
+    return result
+
+def file_ast(source, children=None):
+    return TreeSitterAST(None, 0, len(source), source, children)
+
+def treesitter_parse(code: str, language='python'):
+    """
+    Returns the TreeSitterAST for a file, built lazily from the tree_sitter.Tree.
+    If there is no parser for the language, the file is just a single code block.
+    """
+    tree = None if language is None else parser_for(language).parse(bytes(code, "utf8"))
+    return file_ast(SourceCode(code, language, tree))
+
+def treesitter_ast_with_other_code_blocks(code: str, language='python'):
+    return treesitter_parse(code, language)
 
 def treesitter_ast(path):
     assert isinstance(path, Path)
     with path.open('r') as file:
         code = file.read()
-    return treesitter_ast_with_other_code_blocks(code)
+    return treesitter_parse(code, language_for_path(path))
+
+
+#### Incremental reparsing, used when we know the previous contents and tree of a file.
+def edit_range(before: bytes, after: bytes):
+    """
+    Returns (start, old_end, new_end), such that before[start:old_end] was replaced by after[start:new_end].
+
+    Binary searches for the common prefix and suffix, so the comparisons run on whole slices.
+    """
+    n = min(len(before), len(after))
+    lo, hi = 0, n
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if before[:mid] == after[:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    prefix = lo
+
+    #The suffix can't overlap the prefix.
+    lo, hi = 0, n - prefix
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if before[len(before)-mid:] == after[len(after)-mid:]:
+            lo = mid
+        else:
+            hi = mid - 1
+    suffix = lo
+
+    return prefix, len(before) - suffix, len(after) - suffix
+
+def point(code: bytes, byte):
+    """
+    Converts a byte offset to a tree_sitter (row, column) point.
+    """
+    row = code.count(b'\n', 0, byte)
+    column = byte - (code.rfind(b'\n', 0, byte) + 1)
+    return (row, column)
+
+def shift(summary, line_delta, byte_delta, source):
+    """
+    Copy of a TreeSitterAST for a definition, moved by line_delta lines and byte_delta bytes, and pointing at the new source.
+    Children that haven't been found yet are left to be found from the new tree.
+    """
+    children = None
+    if summary._children is not None:
+        children = {name: shift(child, line_delta, byte_delta, source) for (name, child) in summary._children.items()}
+    pending = None
+    if summary.pending is not None:
+        pending = [(sb+byte_delta, eb+byte_delta, sl+line_delta, el+line_delta, name) for (sb, eb, sl, el, name) in summary.pending]
+    return TreeSitterAST(
+        summary.signature, 
+        summary.start_line+line_delta, 
+        summary.end_line+line_delta, 
+        source, 
+        children, 
+        name=summary.name, 
+        start_byte=summary.start_byte+byte_delta, 
+        end_byte=summary.end_byte+byte_delta, 
+        pending=pending
+    )
+
+def treesitter_ast_edit(old_ast, after: str):
+    """
+    Reparses after an edit, given the TreeSitterAST for the previous contents of the
+    file, which should still have its tree_sitter.Tree.
+
+    Only the top-level definitions touched by the edit are found again in the new tree.
+    The nodes for other definitions are copied, shifting those after the edit.
+
+    The old tree is modified and reused, so old_ast will reparse from scratch if it needs to find more children.
+    """
+    old_source = old_ast.source
+    language = old_source.language
+    #The old tree is edited, and the old nodes are copied, so they can't be used by another thread meanwhile.
+    with old_source.lock:
+        old_tree = old_source.tree
+        assert old_tree is not None
+
+        #Must be found before the old tree is modified.
+        old_definitions = [summary for summary in old_ast.children.values() if summary.signature != '']
+
+        before_bytes = bytes(old_source.code, "utf8")
+        after_bytes = bytes(after, "utf8")
+
+        start, old_end, new_end = edit_range(before_bytes, after_bytes)
+        start_point = point(before_bytes, start)
+        old_end_point = point(before_bytes, old_end)
+        new_end_point = point(after_bytes, new_end)
+        line_delta = new_end_point[0] - old_end_point[0]
+        byte_delta = new_end - old_end
+
+        old_tree.edit(
+            start_byte=start,
+            old_end_byte=old_end,
+            new_end_byte=new_end,
+            start_point=start_point,
+            old_end_point=old_end_point,
+            new_end_point=new_end_point,
+        )
+        old_source.tree = None
+        tree = parser_for(language).parse(after_bytes, old_tree)
+        source = SourceCode(after, language, tree)
+
+        #Lines that need rebuilding (new coordinates, inclusive), extended to cover
+        #whole top-level syntax nodes touched by the edit, or whose structure changed.
+        first_line = start_point[0]
+        last_line = new_end_point[0]
+        for changed in old_tree.changed_ranges(tree):
+            first_line = min(first_line, changed.start_point[0])
+            last_line = max(last_line, changed.end_point[0])
+
+        #Extending the lines can make more nodes overlap (e.g. if two nodes share a line), so repeat until nothing changes.
+        lines = None
+        while lines != (first_line, last_line):
+            lines = (first_line, last_line)
+            rebuilt_nodes = []
+            for node in tree.root_node.children:
+                if node.start_point[0] <= last_line and first_line <= node.end_point[0]:
+                    rebuilt_nodes.append(node)
+                    first_line = min(first_line, node.start_point[0])
+                    last_line = max(last_line, node.end_point[0])
+
+        rebuilt = [definition_ast(d, source) for d in outermost_definitions(rebuilt_nodes, language)]
+        before = [shift(summary, 0, 0, source) for summary in old_definitions if summary.end_line <= first_line]
+        after_edit = [shift(summary, line_delta, byte_delta, source) for summary in old_definitions if last_line < summary.start_line + line_delta]
+
+    children = named_children([*before, *rebuilt, *after_edit])
+    return file_ast(source, add_other_code_blocks(source, children))
+
 #    
 #
 ## Example usage
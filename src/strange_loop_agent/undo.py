@@ -0,0 +1,173 @@
+"""
+Undo/redo journal for the files the agent writes, kept in the hash directory
+(usually `.agent`), so it works across restarts.
+
+Each step of the journal is the list of files written in one assistant response,
+as (path, before, after), where before and after are the hashes of the file contents
+(before is None if the file didn't exist).  The contents themselves live in a blob
+store: one zlib-compressed file per distinct version, named by its hash.  So rewriting
+a big file many times only stores each version once, and nothing is held in memory.
+
+Undoing a step moves it to the redo stack, and writing anything new clears the redo stack.
+As the journal outlives the session, files may have been edited since a step, so check
+undo_conflicts/redo_conflicts before undoing/redoing, to avoid overwriting the edits.
+"""
+
+import os
+import json
+import zlib
+import hashlib
+from pathlib import Path
+from typing import Optional
+
+from .FullPath import record_write
+from .utils import hash_file
+
+UNDO_VERSION = 1
+max_steps = 1000
+
+class BlobStore():
+    def __init__(self, directory):
+        self.dir = Path(directory)
+        self.dir.mkdir(parents=True, exist_ok=True)
+
+    def blob_path(self, key):
+        return self.dir / key[:2] / key[2:]
+
+    def put(self, text:Optional[str]):
+        """
+        Stores text (if it isn't already stored), and returns its hash.  None (no file) is stored as None.
+        """
+        if text is None:
+            return None
+        data = text.encode('utf-8')
+        key = hashlib.sha256(data).hexdigest()
+        path = self.blob_path(key)
+        if not path.exists():
+            path.parent.mkdir(exist_ok=True)
+            tmp_path = path.with_suffix('.tmp')
+            with tmp_path.open('wb') as file:
+                file.write(zlib.compress(data))
+            os.replace(tmp_path, path)
+        return key
+
+    def get(self, key:Optional[str]):
+        if key is None:
+            return None
+        with self.blob_path(key).open('rb') as file:
+            return zlib.decompress(file.read()).decode('utf-8')
+
+    def gc(self, referenced):
+        """
+        Removes blobs whose hash isn't in referenced.
+        """
+        for subdir in self.dir.iterdir():
+            if not subdir.is_dir():
+                continue
+            for path in subdir.iterdir():
+                if subdir.name + path.name not in referenced:
+                    path.unlink(missing_ok=True)
+
+def content_key(path:Path):
+    #The same key as BlobStore.put, as files are written from text as UTF-8.
+    return hash_file(path) if path.is_file() else None
+
+class UndoJournal():
+    def __init__(self, hash_dir):
+        self.path = Path(hash_dir) / f'undo_v{UNDO_VERSION}.json'
+        self.blobs = BlobStore(Path(hash_dir) / f'blobs_v{UNDO_VERSION}')
+
+        journal = self.load()
+        self.next_id = journal['next_id']
+        #Steps are {'id': int, 'files': [[str(path), before hash, after hash]]}.
+        #Steps from earlier sessions with no files have nothing left to undo (as the States are gone).
+        self.undo_steps = [step for step in journal['undo'] if step['files']]
+        self.redo_steps = [step for step in journal['redo'] if step['files']]
+
+    def load(self):
+        try:
+            with self.path.open('r') as file:
+                return json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {'next_id': 0, 'undo': [], 'redo': []}
+
+    def flush(self):
+        tmp_path = self.path.with_suffix('.tmp')
+        with tmp_path.open('w') as file:
+            json.dump({'next_id': self.next_id, 'undo': self.undo_steps, 'redo': self.redo_steps}, file)
+        os.replace(tmp_path, self.path)
+
+    def gc(self):
+        """
+        Removes blobs that aren't used by any step.
+        """
+        referenced = set()
+        for step in [*self.undo_steps, *self.redo_steps]:
+            for _, before, after in step['files']:
+                referenced.update((before, after))
+        self.blobs.gc(referenced)
+
+    def record(self, writes):
+        """
+        Records a step, where writes is a list of (path, before, after) strings for each file
+        written (before is None for new files).  Returns the id of the step.
+        """
+        files = [[str(path), self.blobs.put(before), self.blobs.put(after)] for (path, before, after) in writes]
+        step = {'id': self.next_id, 'files': files}
+        self.next_id += 1
+        self.undo_steps = [*self.undo_steps[-(max_steps-1):], step]
+        self.redo_steps = []
+        self.flush()
+        return step['id']
+
+    def changed_files(self, step, undo):
+        """
+        Paths in step whose contents aren't what the step left (undo) or found (redo).
+        """
+        expected = {}
+        #For a file written twice in the step, undo expects the last after, and redo the first before.
+        for path, before, after in (reversed(step['files']) if undo else step['files']):
+            expected.setdefault(path, after if undo else before)
+        return [path for (path, key) in expected.items() if content_key(Path(path)) != key]
+
+    def undo_conflicts(self):
+        return self.changed_files(self.undo_steps[-1], undo=True) if self.undo_steps else []
+
+    def redo_conflicts(self):
+        return self.changed_files(self.redo_steps[-1], undo=False) if self.redo_steps else []
+
+    def undo(self):
+        """
+        Puts back the files from before the last step, and returns its id (or None if there's nothing to undo).
+        """
+        if not self.undo_steps:
+            return None
+        step = self.undo_steps.pop()
+        #Undo the writes in reverse, in case one file was written twice in the step.
+        for path, before, after in reversed(step['files']):
+            self.restore(Path(path), after, before)
+        self.redo_steps.append(step)
+        self.flush()
+        return step['id']
+
+    def redo(self):
+        """
+        Writes the files from the last undone step again, and returns its id (or None if there's nothing to redo).
+        """
+        if not self.redo_steps:
+            return None
+        step = self.redo_steps.pop()
+        for path, before, after in step['files']:
+            self.restore(Path(path), before, after)
+        self.undo_steps.append(step)
+        self.flush()
+        return step['id']
+
+    def restore(self, path:Path, current_key, new_key):
+        new = self.blobs.get(new_key)
+        if new is None:
+            path.unlink(missing_ok=True)
+        else:
+            with path.open('w') as file:
+                file.write(new)
+            record_write(path, self.blobs.get(current_key), new)
@@ -0,0 +1,186 @@
+"""
+Watches the paths that have been summarized, so that we only need to update
+summaries for paths that might have changed.
+
+Watchers number the changes they see, using an increasing sequence number.
+A summary records the sequence number just before it was built, and is
+stale if its path has changed since then.  Using sequence numbers (rather
+than e.g. clearing a set of changed paths) means that old summaries
+(e.g. restored by undo) are still checked correctly.
+
+On Linux, we use inotify, so checking for changes only costs O(changes).
+Elsewhere (or if inotify fails) we fall back to polling, which stats every
+watched path, but still avoids re-reading and re-parsing unchanged files.
+"""
+
+import os
+import sys
+import struct
+import threading
+import ctypes
+import ctypes.util
+from pathlib import Path
+
+class Watcher():
+    def __init__(self):
+        self.seq = 0
+        self.changed_at = {}        # Path -> seq at which it last changed.
+        self.all_changed_at = 0     # seq at which we lost track, so everything could have changed.
+        #Shared by summaries refreshed in a thread pool, and indexes refreshed in the background.
+        self.lock = threading.RLock()
+
+    def mark_changed(self, path):
+        self.changed_at[path] = self.seq
+
+    def mark_all_changed(self):
+        self.all_changed_at = self.seq
+
+    def poll(self):
+        """
+        Records any changes since the last poll, and returns the current sequence number.
+        """
+        with self.lock:
+            self.seq += 1
+            self.read_changes()
+            return self.seq
+
+    def changed_since(self, path, seq):
+        return seq < max(self.changed_at.get(path, 0), self.all_changed_at)
+
+    def changed_paths(self, seq):
+        """
+        All the paths that changed since seq, or None if we lost track, so anything could have changed.
+        """
+        with self.lock:
+            if seq < self.all_changed_at:
+                return None
+            return [path for (path, changed_at) in self.changed_at.items() if seq < changed_at]
+
+
+IN_MODIFY      = 0x00000002
+IN_ATTRIB      = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM  = 0x00000040
+IN_MOVED_TO    = 0x00000080
+IN_CREATE      = 0x00000100
+IN_DELETE      = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF   = 0x00000800
+IN_Q_OVERFLOW  = 0x00004000
+IN_IGNORED     = 0x00008000
+IN_ONLYDIR     = 0x01000000
+
+#Changes to the names in the directory.
+IN_LISTING = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_LISTING | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+
+#struct inotify_event: int wd; uint32_t mask; uint32_t cookie; uint32_t len; char name[len];
+EVENT_HEADER = struct.Struct('iIII')
+
+class InotifyWatcher(Watcher):
+    """
+    Watches directories, which reports changes to the directory listing, and
+    to the files in the directory.  So a file is watched through its directory.
+    """
+    def __init__(self):
+        super().__init__()
+        if not sys.platform.startswith('linux'):
+            raise OSError("inotify is only available on Linux")
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.wd_dirs = {}           # watch descriptor -> directory
+        self.watched_dirs = set()
+        self.unwatched = set()      # Paths we couldn't watch (e.g. we ran out of watches), which are always stale.
+
+    def watch(self, path):
+        path = Path(path)
+        directory = path if path.is_dir() else path.parent
+        with self.lock:
+            if directory in self.watched_dirs:
+                return
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+            if wd < 0:
+                self.unwatched.add(path)
+            else:
+                self.wd_dirs[wd] = directory
+                self.watched_dirs.add(directory)
+
+    def read_changes(self):
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                name = data[offset+EVENT_HEADER.size:offset+EVENT_HEADER.size+length].rstrip(b'\0')
+                offset += EVENT_HEADER.size + length
+                self.handle_event(wd, mask, os.fsdecode(name))
+
+    def handle_event(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            self.mark_all_changed()
+            return
+
+        directory = self.wd_dirs.get(wd)
+        if directory is None:
+            return
+
+        if mask & IN_MOVE_SELF:
+            #Everything below the directory has moved, and we don't know where to.
+            self.mark_all_changed()
+        if name:
+            self.mark_changed(directory / name)
+        if mask & (IN_LISTING | IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+            self.mark_changed(directory)
+        if mask & IN_IGNORED:
+            #The directory was deleted or moved, so the watch has gone.
+            del self.wd_dirs[wd]
+            self.watched_dirs.discard(directory)
+
+    def changed_since(self, path, seq):
+        return (path in self.unwatched) or super().changed_since(path, seq)
+
+    def changed_paths(self, seq):
+        result = super().changed_paths(seq)
+        return None if result is None else [*result, *self.unwatched]
+
+
+class PollingWatcher(Watcher):
+    """
+    Stats every watched path on each poll.
+    For directories, the modification time changes when the directory listing changes.
+    """
+    def __init__(self):
+        super().__init__()
+        self.stats = {}             # Path -> stat signature
+
+    def stat(self, path):
+        try:
+            stat = path.stat()
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino, stat.st_mode)
+
+    def watch(self, path):
+        path = Path(path)
+        with self.lock:
+            if path not in self.stats:
+                self.stats[path] = self.stat(path)
+
+    def read_changes(self):
+        for path, prev_stat in self.stats.items():
+            stat = self.stat(path)
+            if stat != prev_stat:
+                self.stats[path] = stat
+                self.mark_changed(path)
+
+
+def make_watcher():
+    try:
+        return InotifyWatcher()
+    except (OSError, AttributeError):
+        return PollingWatcher()
@@ -0,0 +1,61 @@
+import os
+from strange_loop_agent import FullPath as fp
+from strange_loop_agent.FullPath import FullPath
+
+def test_iterdir_tracked_doesnt_read_files(tmp_path, monkeypatch):
+    for i in range(5000):
+        (tmp_path / f'{i:04}.py').write_text('x = 1\n')
+    (tmp_path / 'subdir').mkdir()
+    (tmp_path / '.hidden').write_text('x = 1\n')
+    (tmp_path / 'file.swp').write_text('x = 1\n')
+
+    def fail(path):
+        raise AssertionError("Shouldn't read files to list a directory")
+    monkeypatch.setattr(fp, '_is_utf8', fail)
+    monkeypatch.setattr(fp, 'treesitter_parse', fail)
+
+    children = FullPath(tmp_path).iterdir_tracked()
+
+    names = [child.path.name for child in children]
+    assert len(names) == 5001
+    assert names[0] == '0000.py' and 'subdir' in names
+    assert '.hidden' not in names and 'file.swp' not in names
+
+def names(path):
+    return [child.path.name for child in FullPath(path).iterdir_tracked()]
+
+def test_iterdir_tracked_uses_ignore_files(tmp_path):
+    (tmp_path / '.git').mkdir()
+    (tmp_path / '.gitignore').write_text('build/\n*.log\n')
+    for d in ['build', 'src', 'src/node_modules', 'src/data']:
+        (tmp_path / d).mkdir()
+    for f in ['a.py', 'a.log', 'src/b.py', 'src/keep.log', 'src/c.log']:
+        (tmp_path / f).write_text('x = 1\n')
+    (tmp_path / 'src' / '.gitignore').write_text('!keep.log\n')
+    (tmp_path / 'src' / '.agentignore').write_text('node_modules/\ndata\n')
+
+    assert names(tmp_path) == ['a.py', 'src']
+    assert names(tmp_path / 'src') == ['b.py', 'keep.log']
+
+    #Ignore files are re-read when they change.
+    (tmp_path / 'src' / '.agentignore').write_text('data\n')
+    os.utime(tmp_path / 'src' / '.agentignore', (0, 0))
+    assert names(tmp_path / 'src') == ['b.py', 'keep.log', 'node_modules']
+
+def test_ignore_files_above_agent_root_outside_repo(tmp_path, monkeypatch):
+    (tmp_path / '.gitignore').write_text('*.log\n')
+    root = tmp_path / 'root'
+    root.mkdir()
+    (root / '.gitignore').write_text('build/\n')
+    for f in ['a.py', 'a.log', 'build/b.py']:
+        (root / f).parent.mkdir(exist_ok=True)
+        (root / f).write_text('x = 1\n')
+    monkeypatch.chdir(root)
+    assert names(root) == ['a.log', 'a.py']
+
+def test_iterdir_tracked_skips_unreadable_files(tmp_path, monkeypatch):
+    (tmp_path / 'a.py').write_text('x = 1\n')
+    (tmp_path / 'secret.py').write_text('x = 1\n')
+    access = os.access
+    monkeypatch.setattr(os, 'access', lambda path, mode: not str(path).endswith('secret.py') and access(path, mode))
+    assert names(tmp_path) == ['a.py']
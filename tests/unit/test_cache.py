@@ -0,0 +1,126 @@
+import pytest
+from strange_loop_agent import FullPath as fp
+from strange_loop_agent import cache as cache_module
+from strange_loop_agent.cache import LRUCache, PersistentCache, CACHE_PREFIX
+
+code = """
+def f(x):
+    return x
+
+class A:
+    def method(self):
+        pass
+"""
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(10, sizeof=len)
+    cache['a'] = 'xxxx'
+    cache['b'] = 'xxxx'
+    assert cache.get('a') == 'xxxx'
+    cache['c'] = 'xxxx'
+    assert 'b' not in cache
+    assert 'a' in cache and 'c' in cache
+    assert cache.size == 8
+
+def test_lru_evicts_superseded_keys():
+    cache = LRUCache(100, group=lambda key: key[0])
+    cache[('file.py', 1.0, 10)] = 'old'
+    cache[('other.py', 1.0, 10)] = 'other'
+    cache[('file.py', 2.0, 12)] = 'new'
+    assert ('file.py', 1.0, 10) not in cache
+    assert cache.get(('file.py', 2.0, 12)) == 'new'
+    assert cache.get(('file.py', 1.0, 10)) is None
+    assert len(cache) == 2 and cache.size == 2
+
+def test_lru_recharges_values_that_grow():
+    cache = LRUCache(10, sizeof=len)
+    cache['a'] = ['x']
+    cache['b'] = ['x']
+    value = cache.get('b')
+    value.extend('x' * 9)
+    assert cache.size == 2
+    cache.recharge('b')
+    assert 'a' not in cache
+    assert cache.size == 10
+
+def test_parses_are_recharged_after_expansion(source, monkeypatch):
+    monkeypatch.setattr(fp, 'treesitter_cache', LRUCache(2**20, sizeof=lambda ast: ast.nbytes(), group=fp.key_path))
+    ast = fp.treesitter_file_ast(source)
+    size = fp.treesitter_cache.size
+    ast.index(('A', 'method'))
+    assert fp.treesitter_file_ast(source) is ast
+    assert size < fp.treesitter_cache.size == ast.nbytes()
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / 'src' / 'example.py'
+    path.parent.mkdir()
+    path.write_text(code)
+    return path
+
+@pytest.fixture
+def hash_dir(tmp_path):
+    hash_dir = tmp_path / '.agent'
+    hash_dir.mkdir()
+    yield hash_dir
+    fp.set_persistent_cache(None)
+
+def test_ast_survives_restart(source, hash_dir, monkeypatch):
+    cache = PersistentCache(hash_dir)
+    fp.set_persistent_cache(cache)
+    ast = fp.treesitter_file_ast(source)
+    assert ast.exists(('A', 'method'))
+    cache.flush()
+
+    #New session: empty in-memory caches, and parsing would fail.
+    monkeypatch.setattr(fp, 'treesitter_cache', LRUCache(2**20))
+    monkeypatch.setattr(fp, 'cache_is_utf8', LRUCache(100))
+    def fail(path):
+        raise AssertionError("Should have been a cache hit")
+    monkeypatch.setattr(fp, 'treesitter_parse', fail)
+    monkeypatch.setattr(fp, '_is_utf8', fail)
+
+    fp.set_persistent_cache(PersistentCache(hash_dir))
+    ast = fp.treesitter_file_ast(source)
+    assert ast.exists(('A', 'method'))
+    assert ast.index(('f',)).code.startswith('def f(x):')
+
+def test_gc(source, hash_dir):
+    old_version = hash_dir / f'{CACHE_PREFIX}0'
+    old_version.mkdir()
+
+    cache = PersistentCache(hash_dir)
+    fp.set_persistent_cache(cache)
+    fp.treesitter_file_ast(source)
+    old_hash = cache.content_hash(source)
+
+    source.write_text(code + "\ndef g():\n    pass\n")
+    cache.set_ast(source, 'python', fp.treesitter_parse(source.read_text()))
+    cache.flush()
+    new_hash = cache.content_hash(source)
+    assert old_hash != new_hash
+
+    cache.gc()
+    assert not old_version.exists()
+    assert not cache.ast_path(old_hash, 'python').exists()
+    assert cache.ast_path(new_hash, 'python').exists()
+
+    source.unlink()
+    cache.gc()
+    assert not cache.ast_path(new_hash, 'python').exists()
+    assert str(source) not in cache.index
+
+def test_parses_are_written_in_batches(tmp_path, hash_dir, monkeypatch):
+    monkeypatch.setattr(cache_module, 'max_pending_asts', 3)
+    monkeypatch.setattr(cache_module, 'index_flush_interval', -1)
+    cache = PersistentCache(hash_dir)
+    paths = []
+    for i in range(3):
+        path = tmp_path / f'f{i}.py'
+        path.write_text(f'def f{i}():\n    pass\n')
+        paths.append(path)
+        cache.set_ast(path, 'python', fp.treesitter_parse(path.read_text()))
+    assert cache.pending_asts == {}
+    for path in paths:
+        assert cache.ast_path(cache.content_hash(path), 'python').exists()
+    assert PersistentCache(hash_dir).index.keys() == cache.index.keys()
@@ -0,0 +1,38 @@
+from strange_loop_agent.messages import Messages, Message, TextBlock, ToolResultBlock, Log
+
+def test_log_shares_previous_items():
+    empty = Log()
+    a = empty.append(1)
+    ab = a.append(2)
+    ac = a.append(3)
+    assert list(empty) == [] and list(a) == [1]
+    assert list(ab) == [1, 2] and list(ac) == [1, 3]
+    assert list(ab.replace_last(4)) == [1, 4]
+    assert ab.prev is a and ac.prev is a
+    assert len(ab) == 2
+
+def test_old_messages_are_unchanged():
+    messages = Messages([]).append_text('user', 'hello')
+    with_reply = messages.append_text('assistant', 'hi')
+    with_tool_result = with_reply.append_text('user', 'a').append_block('user', ToolResultBlock('id', 'result'))
+
+    assert messages.dump() == [{'role': 'user', 'content': [{'type': 'text', 'text': 'hello'}]}]
+    assert len(with_reply.dump()) == 2
+    assert with_tool_result.dump()[-1] == {'role': 'user', 'content': [
+        {'type': 'text', 'text': 'a'},
+        {'type': 'tool_result', 'tool_use_id': 'id', 'content': 'result'},
+    ]}
+    #Appending to the last message shares all the earlier messages.
+    assert with_tool_result.messages.prev is with_reply.messages
+
+def test_dump_is_memoized_and_cache_control_is_on_a_copy():
+    messages = Messages([]).append_text('user', 'a').append_text('assistant', 'b').append_text('user', 'c')
+    first = messages.messages.prev.prev.last
+    assert messages.dump()[0] is first.dump()
+
+    dumped = messages.dump(cache_breakpoints=[-1, -3])
+    assert dumped[0]['content'][0]['cache_control'] == {"type": "ephemeral"}
+    assert dumped[2]['content'][0]['cache_control'] == {"type": "ephemeral"}
+    assert dumped[1] is messages.dump()[1]
+    #The memoized dumps don't have cache_control.
+    assert 'cache_control' not in messages.dump()[0]['content'][0]
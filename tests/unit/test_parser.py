@@ -0,0 +1,52 @@
+import pytest
+
+from strange_loop_agent.parser import parse_writes, WriteParser, Write, Replace
+from strange_loop_agent.exceptions import AgentException
+
+text = '''I'll fix it.
+<write path="src/a.py">
+def f(x):
+    return x < 1
+</write>
+Then rename it.
+<replace path='src/b.py#g'>
+<pattern>old_name</pattern>
+<replacement>new_name</replacement>
+</replace>
+Done, x < y <wr'''
+
+def describe(items):
+    result = []
+    for item in items:
+        if isinstance(item, Write):
+            result.append(('write', item.full_path.path.name, item.full_path.parts, item.after))
+        elif isinstance(item, Replace):
+            result.append(('replace', item.full_path.path.name, item.full_path.parts, item.pattern, item.replacement))
+        else:
+            result.append(item)
+    return result
+
+def test_parse_writes():
+    assert describe(parse_writes(text)) == [
+        "I'll fix it.",
+        ('write', 'a.py', (), 'def f(x):\n    return x < 1'),
+        'Then rename it.',
+        ('replace', 'b.py', ('g',), 'old_name', 'new_name'),
+        'Done, x < y <wr',
+    ]
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 5, 13])
+def test_chunks_give_the_same_result(chunk_size):
+    parser = WriteParser()
+    items = []
+    for i in range(0, len(text), chunk_size):
+        items.extend(parser.feed(text[i:i+chunk_size]))
+        if i + chunk_size <= text.index('</write>'):
+            #The write is only returned once the closing tag arrives.
+            assert not any(isinstance(item, Write) for item in items)
+    items.extend(parser.close())
+    assert describe(items) == describe(parse_writes(text))
+
+def test_unclosed_tag():
+    with pytest.raises(AgentException):
+        parse_writes('<write path="a.py">\nx = 1\n')
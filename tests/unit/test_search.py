@@ -0,0 +1,62 @@
+import time
+from strange_loop_agent.search import TrigramIndex
+
+def found(index, query, max_results=10, **kwargs):
+    matches, truncated = index.search(query, max_results, **kwargs)
+    return [(str(path).split('/')[-1], line_number, line) for (path, line_number, line) in matches], truncated
+
+def write(path, text):
+    path.write_text(text)
+    #Make sure a polling watcher sees a new mtime.
+    time.sleep(0.01)
+
+def test_search(tmp_path):
+    (tmp_path / 'a.py').write_text('import os\n\ndef f():\n    return os.getcwd()\n\nclass A:\n    def g(self):\n        return os.sep\n')
+    (tmp_path / 'b.py').write_text('x = 1\n')
+    (tmp_path / '.hidden.py').write_text('os.getcwd()\n')
+    index = TrigramIndex(tmp_path)
+
+    assert found(index, 'os.') == ([
+        ('a.py#f', 4, '    return os.getcwd()'),
+        ('a.py#A#g', 8, '        return os.sep'),
+    ], False)
+    assert found(index, 'import os') == ([('a.py#%code_block_1', 1, 'import os')], False)
+    assert found(index, 'OS.SEP') == ([], False)
+    assert found(index, 'OS.SEP', ignore_case=True)[0][0][1] == 8
+    assert found(index, 'os', max_results=2) == ([
+        ('a.py#%code_block_1', 1, 'import os'),
+        ('a.py#f', 4, '    return os.getcwd()'),
+    ], True)
+
+    #Incremental updates.
+    write(tmp_path / 'b.py', 'y = os.sep\n')
+    (tmp_path / 'a.py').unlink()
+    assert found(index, 'os.') == ([('b.py#%code_block_1', 1, 'y = os.sep')], False)
+
+    #Changed files leave old ids in the postings, until they're compacted.
+    for i in range(3):
+        write(tmp_path / 'b.py', f'y = {i}\n')
+        assert found(index, f'y = {i}')[0] == [('b.py#%code_block_1', 1, f'y = {i}')]
+    assert index.dead < len(index.keys)
+
+def test_search_file_edge_cases(tmp_path):
+    path = tmp_path / 'a.py'
+    path.write_text('x = 1\ny = 2\nSTRASSE = 3\n')
+    index = TrigramIndex(tmp_path)
+
+    #A query starting with a newline gives each line once.
+    assert found(index, '\ny') == ([('a.py#%code_block_1', 1, 'x = 1')], False)
+
+    #casefold changes the length of 'ß', but the lines still line up.
+    path.write_text('straße = 0\nx = "ẞ"\nSTRASSE = 3\n')
+    time.sleep(0.01)
+    assert found(index, 'strasse', ignore_case=True) == ([
+        ('a.py#%code_block_1', 1, 'straße = 0'),
+        ('a.py#%code_block_1', 3, 'STRASSE = 3'),
+    ], False)
+
+def test_short_queries_skip_binary_files(tmp_path):
+    (tmp_path / 'a.py').write_text('xy = 1\n')
+    (tmp_path / 'b.bin').write_bytes(b'xy\x00\n')
+    index = TrigramIndex(tmp_path)
+    assert found(index, 'xy') == ([('a.py#%code_block_1', 1, 'xy = 1')], False)
@@ -0,0 +1,52 @@
+from types import SimpleNamespace as NS
+
+from strange_loop_agent.streaming import anthropic_stream_to_response, openai_stream_to_response
+
+def test_anthropic_stream_prints_text_and_assembles_tool_use():
+    events = [
+        NS(type='message_start'),
+        NS(type='content_block_start', index=0, content_block=NS(type='text', text='')),
+        NS(type='content_block_delta', index=0, delta=NS(type='text_delta', text='Let me ')),
+        NS(type='content_block_delta', index=0, delta=NS(type='text_delta', text='look.')),
+        NS(type='content_block_stop', index=0),
+        NS(type='content_block_start', index=1, content_block=NS(type='tool_use', id='tool_1', name='search', input={})),
+        NS(type='content_block_delta', index=1, delta=NS(type='input_json_delta', partial_json='{"query": ')),
+        NS(type='content_block_delta', index=1, delta=NS(type='input_json_delta', partial_json='"foo"}')),
+        NS(type='content_block_stop', index=1),
+        NS(type='message_stop'),
+    ]
+    printed = []
+    response = anthropic_stream_to_response(events, printed.append)
+    assert printed == ['Let me ', 'look.']
+    text, tool_use = response.content
+    assert (text.type, text.text) == ('text', 'Let me look.')
+    assert (tool_use.type, tool_use.id, tool_use.name, tool_use.input) == ('tool_use', 'tool_1', 'search', {'query': 'foo'})
+
+def test_openai_stream_assembles_tool_calls():
+    def chunk(content=None, tool_calls=None):
+        return NS(choices=[NS(delta=NS(content=content, tool_calls=tool_calls))])
+    def call(index, _id=None, name=None, arguments=None):
+        return NS(index=index, id=_id, function=NS(name=name, arguments=arguments))
+    chunks = [
+        chunk('Hi'),
+        chunk(tool_calls=[call(0, 'call_1', 'find_symbol', '{"name"')]),
+        chunk(tool_calls=[call(0, arguments=': "State"}')]),
+        chunk(tool_calls=[call(1, 'call_2', 'search', '')]),
+        NS(choices=[]),
+    ]
+    printed = []
+    response = openai_stream_to_response(chunks, printed.append)
+    assert printed == ['Hi']
+    assert [block.type for block in response.content] == ['text', 'tool_use', 'tool_use']
+    assert response.content[1].input == {'name': 'State'}
+    assert response.content[2].input == {}
+
+def test_truncated_tool_input_keeps_the_block_with_an_error():
+    events = [
+        NS(type='content_block_start', index=0, content_block=NS(type='tool_use', id='tool_1', name='search', input={})),
+        NS(type='content_block_delta', index=0, delta=NS(type='input_json_delta', partial_json='{"query": "fo')),
+        NS(type='message_stop'),
+    ]
+    (tool_use,) = anthropic_stream_to_response(events, lambda text: None).content
+    assert (tool_use.id, tool_use.input) == ('tool_1', {})
+    assert tool_use.error.startswith('Invalid JSON as tool input')
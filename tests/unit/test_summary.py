@@ -0,0 +1,130 @@
+import subprocess
+import pytest
+from strange_loop_agent import summary
+from strange_loop_agent import FullPath as fp
+from strange_loop_agent.FullPath import FullPath
+
+@pytest.mark.parametrize('kind', ['thread', 'process'])
+def test_pool_refresh_matches_serial(tmp_path, kind, monkeypatch):
+    for i in range(6):
+        (tmp_path / f'{i}.py').write_text(f'def f{i}():\n    pass\n')
+    summaries, _ = summary.add_summaries_from_token_sources({}, [(FullPath(tmp_path), 10000)])
+    for i in range(0, 6, 2):
+        (tmp_path / f'{i}.py').write_text(f'def g{i}():\n    pass\n')
+    (tmp_path / '5.py').unlink()
+
+    serial_summaries, serial_messages = summary.update_delete_summaries(summaries)
+
+    monkeypatch.setattr(summary, 'pool_min_summaries', 1)
+    with summary.make_pool(kind, 2) as pool:
+        summary.set_pool(pool)
+        try:
+            pool_summaries, pool_messages = summary.update_delete_summaries(summaries)
+        finally:
+            summary.set_pool(None)
+
+    assert pool_messages == serial_messages
+    assert list(pool_summaries.keys()) == list(serial_summaries.keys())
+    assert [s.contents for s in pool_summaries.values()] == [s.contents for s in serial_summaries.values()]
+
+def test_thread_pool_parses_reach_the_main_cache(tmp_path, monkeypatch):
+    for i in range(6):
+        (tmp_path / f'{i}.py').write_text(f'def f{i}():\n    pass\n')
+    summaries, _ = summary.add_summaries_from_token_sources({}, [(FullPath(tmp_path), 10000)])
+    for i in range(6):
+        (tmp_path / f'{i}.py').write_text(f'def g{i}():\n    pass\n')
+
+    monkeypatch.setattr(summary, 'pool_min_summaries', 1)
+    with summary.make_pool('thread', 2) as pool:
+        summary.set_pool(pool)
+        try:
+            summary.update_delete_summaries(summaries)
+        finally:
+            summary.set_pool(None)
+
+    for i in range(6):
+        assert fp.file_key(tmp_path / f"{i}.py") in fp.treesitter_cache
+
+def test_code_update_message_only_includes_changed_parts(tmp_path):
+    functions = [f'def f{i}(x):\n    y = x + {i}\n    return y\n' for i in range(50)]
+    path = tmp_path / 'a.py'
+    path.write_text('\n'.join(functions))
+    prev_summary = summary.CodeSummary(FullPath(path), 3)
+
+    functions[10] = 'def f10(x):\n    y = x - 10\n    return y\n'
+    functions[20] = 'def g(x):\n    return x\n'
+    path.write_text('\n'.join(functions))
+    message = summary.CodeSummary(FullPath(path), 3).update_message(prev_summary)
+
+    assert f'<modified path={path}#f10>\n@@ -1,3 +1,3 @@\n def f10(x):\n-    y = x + 10\n+    y = x - 10\n     return y\n</modified>' in message
+    assert f'<added path={path}#g>\ndef g(x):\n    return x\n</added>' in message
+    assert f'<removed path={path}#f20/>' in message
+    assert 'f30' not in message
+
+@pytest.fixture
+def tree(tmp_path):
+    for d in ['a', 'a/b', 'c']:
+        (tmp_path / d).mkdir()
+    for f in ['x.py', 'a/y.py', 'a/b/z.py', 'c/w.py']:
+        (tmp_path / f).write_text('def f():\n' + '    pass\n' * 20)
+    return tmp_path
+
+def names(tree, summaries):
+    return sorted(str(path).removeprefix(str(tree)) for (path, _) in summaries)
+
+def test_source_is_always_included(tree):
+    assert names(tree, summary.new_summaries_from_token_source(FullPath(tree), 1)) == ['']
+
+@pytest.mark.parametrize('max_tokens', [20, 50, 100, 200])
+def test_summaries_fit_in_budget(tree, max_tokens):
+    summaries = summary.new_summaries_from_token_source(FullPath(tree), max_tokens)
+    assert sum(s.tokens() for (_, s) in summaries) <= max_tokens
+
+def test_large_budget_gives_full_code(tree):
+    summaries = dict(summary.new_summaries_from_token_source(FullPath(tree), 10000))
+    assert names(tree, summaries.items()) == ['', '/a', '/a/b', '/a/b/z.py', '/a/y.py', '/c', '/c/w.py', '/x.py']
+    assert all(s.depth == summary.full_code_depth for s in summaries.values() if isinstance(s, summary.CodeSummary))
+
+def test_big_directory_doesnt_use_whole_budget(tree):
+    big = tree / 'big'
+    big.mkdir()
+    for i in range(50):
+        (big / f'{i}.py').write_text('def f():\n' + '    pass\n' * 100)
+    summaries = summary.new_summaries_from_token_source(FullPath(tree), 300)
+    assert '/x.py' in names(tree, summaries)
+    assert '/c/w.py' in names(tree, summaries)
+
+def git(repo, *args):
+    subprocess.run(['git', '-C', str(repo), *args], check=True, capture_output=True)
+
+def test_git_summary(tmp_path, monkeypatch):
+    git(tmp_path, 'init', '-q')
+    (tmp_path / 'a.py').write_text('x = 1\n')
+    (tmp_path / 'b.py').write_text('x = 1\n')
+    git(tmp_path, 'add', 'a.py', 'b.py')
+
+    summaries, messages = summary.add_git_summary({}, FullPath(tmp_path))
+    git_summary = summaries[FullPath(tmp_path / '.git')]
+    assert git_summary.contents == 'a.py\nb.py'
+
+    #Nothing changed, so the files aren't listed again.
+    ls_files = []
+    original_git = summary.GitSummary.git
+    def counting_git(self, *args):
+        ls_files.extend(arg for arg in args if arg == 'ls-files')
+        return original_git(self, *args)
+    monkeypatch.setattr(summary.GitSummary, 'git', counting_git)
+    assert git_summary.update() is git_summary
+    assert ls_files == []
+
+    (tmp_path / 'c.py').write_text('x = 1\n')
+    git(tmp_path, 'add', 'c.py')
+    summaries, messages = summary.update_delete_summaries(summaries)
+    assert ls_files == ['ls-files']
+    assert summaries[FullPath(tmp_path / '.git')].contents == 'a.py\nb.py\nc.py'
+    assert 'c.py' in messages[0]
+
+def test_git_summary_of_non_repo(tmp_path):
+    summaries, messages = summary.add_git_summary({}, FullPath(tmp_path))
+    assert summaries == {}
+    assert len(messages) == 1
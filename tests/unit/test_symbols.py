@@ -0,0 +1,90 @@
+import time
+from strange_loop_agent import symbols
+from strange_loop_agent import FullPath as fp
+from strange_loop_agent.symbols import SymbolIndex
+from strange_loop_agent.FullPath import FullPath
+
+def found(index, name):
+    return [str(path.path.name) + '#' + '#'.join(path.parts) for (path, _) in index.find(name)]
+
+def write(path, text):
+    path.write_text(text)
+    #Make sure a polling watcher sees a new mtime.
+    time.sleep(0.01)
+
+def test_symbol_index(tmp_path, monkeypatch):
+    root = tmp_path / 'repo'
+    (root / 'pkg').mkdir(parents=True)
+    hash_dir = tmp_path / '.agent'
+    hash_dir.mkdir()
+    (root / 'a.py').write_text('def f():\n    pass\n\nclass A:\n    def f(self):\n        pass\n')
+    (root / 'pkg' / 'b.py').write_text('def g():\n    pass\n')
+
+    index = SymbolIndex(hash_dir, root)
+    assert found(index, 'f') == ['a.py#A#f', 'a.py#f']
+    assert index.find('g')[0][1] == 'def g():'
+
+    #Incremental updates.
+    write(root / 'pkg' / 'b.py', 'def h():\n    pass\n')
+    (root / 'pkg' / 'c.py').write_text('def g():\n    pass\n')
+    (root / 'a.py').unlink()
+    assert found(index, 'f') == []
+    assert found(index, 'g') == ['c.py#g']
+    assert found(index, 'h') == ['b.py#h']
+
+    #Persists between sessions, without reparsing unchanged files.
+    index.flush()
+    parsed = []
+    original_index_file = symbols.index_file
+    monkeypatch.setattr(symbols, 'index_file', lambda path: parsed.append(path) or original_index_file(path))
+    index = SymbolIndex(hash_dir, root)
+    assert found(index, 'h') == ['b.py#h']
+    assert parsed == []
+
+def test_call_graph(tmp_path):
+    (tmp_path / 'a.py').write_text("""
+def f():
+    g()
+    print(1)
+
+class A:
+    def method(self):
+        def inner():
+            f()
+        return self.g()
+
+def g():
+    pass
+
+f()
+""")
+    index = SymbolIndex(tmp_path / '.agent', tmp_path)
+    a = tmp_path / 'a.py'
+
+    callers = [str(path).removeprefix(str(a)) for (path, _) in index.find_callers(FullPath(a, 'g'))]
+    assert callers == ['#A#method', '#f']
+    callers = [str(path).removeprefix(str(a)) for (path, _) in index.find_callers(FullPath(a, 'f'))]
+    assert callers == ['', '#A#method#inner']
+
+    callees, unresolved = index.find_callees(FullPath(a, 'A'))
+    assert [str(path).removeprefix(str(a)) for (path, _) in callees] == ['#f', '#g']
+    assert unresolved == []
+    callees, unresolved = index.find_callees(FullPath(a, 'f'))
+    assert unresolved == ['print']
+
+def test_background_refresh_shares_parses(tmp_path):
+    hash_dir = tmp_path / '.agent'
+    hash_dir.mkdir()
+    root = tmp_path / 'repo'
+    root.mkdir()
+    for i in range(20):
+        (root / f'{i}.py').write_text(f'def f{i}():\n    g()\n')
+
+    index = SymbolIndex(hash_dir, root)
+    index.refresh_in_background()
+    #Lookups wait for the background refresh.
+    assert found(index, 'f7') == ['7.py#f7']
+    assert len(index.find_callers(FullPath(root / '0.py', 'f0'))) == 0
+    assert len(index.callers['g']) == 20
+    #The parses are in the same cache as explore uses.
+    assert fp.file_key(root / '7.py') in fp.treesitter_cache
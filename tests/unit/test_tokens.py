@@ -0,0 +1,31 @@
+from strange_loop_agent.tokens import ApproximateBPECounter, TokenCounter, count_tokens, set_token_counter
+
+def test_approximate_counts():
+    counter = ApproximateBPECounter()
+    assert counter.count('') == 0
+    assert counter.count('hello world') == 2
+    #Punctuation-heavy code costs more tokens per character than prose.
+    code = '{"a":[1,2],"b":{"c":null}}'
+    prose = 'the cat sat on the mat and '
+    assert counter.count(prose) < counter.count(code)
+    #Non-ASCII text is counted per character, not per 4 bytes.
+    assert counter.count('日本語のテキスト') == 8
+
+class CountingCounter(TokenCounter):
+    def __init__(self):
+        self.calls = 0
+
+    def count(self, text):
+        self.calls += 1
+        return len(text)
+
+def test_counts_are_memoized():
+    counter = CountingCounter()
+    set_token_counter(counter)
+    try:
+        assert count_tokens('some text') == 9
+        assert count_tokens('some text') == 9
+        assert count_tokens('other text') == 10
+        assert counter.calls == 2
+    finally:
+        set_token_counter(ApproximateBPECounter())
@@ -0,0 +1,195 @@
+import pytest
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+from strange_loop_agent import treesitter
+from strange_loop_agent.treesitter import treesitter_ast_with_other_code_blocks, definitions, parser_for, query_for, queries, language_for_path, treesitter_parse, treesitter_ast_edit, edit_range, match_definition
+
+code = """import os
+
+class A:
+    def f(self):
+        def g(): pass
+        class B:
+            def h(self): pass
+    def k(self): pass
+
+x = 1
+
+def top(): pass
+def top(): pass
+"""
+
+def test_nesting():
+    ast = treesitter_ast_with_other_code_blocks(code)
+    assert [*ast.children.keys()] == ['%code_block_1', 'A', '%code_block_2', 'top', 'top2']
+    assert [*ast.index(('A',)).children.keys()] == ['f', 'k']
+    #B starts on the line after g ends, so it is a sibling of g, not a child.
+    assert [*ast.index(('A', 'f')).children.keys()] == ['g', 'B']
+    assert ast.exists(('A', 'f', 'B', 'h'))
+    assert ast.index(('A', 'f', 'B')).code == "        class B:\n            def h(self): pass"
+
+def test_queries_compiled_once():
+    assert parser_for('python') is parser_for('python')
+    assert query_for('python') is query_for('python')
+
+def test_definitions_single_pass():
+    tree = parser_for('python').parse(bytes(code, 'utf8'))
+    names = [name_node.text.decode('utf8') for _, name_node in definitions(tree.root_node, 'python')]
+    assert names == ['A', 'f', 'g', 'B', 'h', 'k', 'top', 'top']
+
+def structure(ast):
+    return {name: (child.signature, child.start_line, child.end_line, child.code, structure(child)) for (name, child) in ast.children.items()}
+
+@pytest.mark.parametrize("before, after", [
+    #Edit inside a method.
+    (code, code.replace("def h(self): pass", "def h(self):\n                return 1")),
+    #Add a top-level function, shifting everything after it.
+    (code, code.replace("x = 1", "x = 1\n\ndef new(y):\n    return y")),
+    #Delete a class.
+    (code, code.replace("class A:\n    def f(self):\n", "def f(self):\n")),
+    #Rename a function, so it now clashes with the later definitions.
+    (code, code.replace("class A:", "class top:")),
+    #Edit only a code block.
+    (code, code.replace("import os", "import os\nimport sys")),
+])
+def test_incremental_matches_full_parse(before, after):
+    old_ast = treesitter_parse(before)
+    #Only find some of the children before the edit.
+    old_ast.index(('A',)).children
+    ast = treesitter_ast_edit(old_ast, after)
+    assert structure(ast) == structure(treesitter_parse(after))
+    assert ast.source.tree.root_node.text.decode('utf8') == after
+    #The old parse is still valid.
+    assert structure(old_ast) == structure(treesitter_parse(before))
+
+def test_incremental_rebuilds_only_touched_definitions(monkeypatch):
+    before = "def a():\n    pass\n\ndef b():\n    pass\n\ndef c():\n    pass\n"
+    after = before.replace("def b():\n    pass", "def b():\n    return 1\n    return 2")
+    old_ast = treesitter_parse(before)
+    old_ast.children
+
+    queried = []
+    def recording_match_definition(node, language):
+        queried.append(node.text.decode('utf8'))
+        return match_definition(node, language)
+    monkeypatch.setattr(treesitter, 'match_definition', recording_match_definition)
+
+    ast = treesitter_ast_edit(old_ast, after)
+    assert queried == ["def b():\n    return 1\n    return 2"]
+    assert ast.children['a'].code == old_ast.children['a'].code
+    assert ast.children['c'].code == old_ast.children['c'].code
+    assert ast.children['c'].start_line == old_ast.children['c'].start_line + 1
+
+def test_nodes_share_source():
+    ast = treesitter_ast_with_other_code_blocks(code)
+    method = ast.index(('A', 'f', 'B'))
+    assert method.source is ast.source
+    assert not hasattr(method, '__dict__')
+    assert ast.code == code
+    assert ast.index(('%code_block_1',)).code == "import os\n"
+
+def test_lazy_expansion(monkeypatch):
+    ast = treesitter_parse(code)
+    assert ast._children is None
+    assert [*ast.children.keys()] == ['%code_block_1', 'A', '%code_block_2', 'top', 'top2']
+    #Children of definitions haven't been found yet.
+    assert ast.children['A']._children is None
+    assert ast.node_count() == 1 + 5
+
+    #Finding the children of A queries once, and the definitions inside A's children are kept, so don't need another query.
+    assert [*ast.index(('A',)).children.keys()] == ['f', 'k']
+    monkeypatch.setattr(treesitter, 'definitions', None)
+    assert [*ast.index(('A', 'f')).children.keys()] == ['g', 'B']
+    assert ast.exists(('A', 'f', 'B', 'h'))
+
+def test_pickle_keeps_laziness():
+    ast = treesitter_parse(code)
+    ast.children
+    unpickled = pickle.loads(pickle.dumps(ast))
+    #Only the nodes built before pickling are pickled.
+    assert ast.node_count() == unpickled.node_count() < 10
+    assert unpickled.source.tree is None
+    #The rest are found by reparsing.
+    assert structure(unpickled) == structure(ast)
+
+def test_expansion_from_threads():
+    #Many nested definitions, all expanded at once (after pickling, so the tree is reparsed too).
+    nested = ''.join(f"class C{i}:\n" + ''.join(f"    def f{j}(self):\n        def g(): pass\n" for j in range(20)) for i in range(20))
+    expected = structure(treesitter_parse(nested))
+    ast = pickle.loads(pickle.dumps(treesitter_parse(nested)))
+    with ThreadPoolExecutor(8) as pool:
+        results = [*pool.map(lambda _: structure(ast), range(8))]
+    assert all(result == expected for result in results)
+    assert ast.source.nodes == ast.node_count()
+
+def test_edit_range():
+    assert edit_range(b'abcdef', b'abXYef') == (2, 4, 4)
+    assert edit_range(b'aaa', b'aaaa') == (3, 3, 4)
+    assert edit_range(b'abc', b'abc') == (3, 3, 3)
+
+samples = {
+    'example.js': ("""
+function top(a) { return a; }
+class Widget {
+  render() { return 1; }
+}
+const arrow = (x) => x;
+""", {'top': {}, 'Widget': {'render': {}}, 'arrow': {}}),
+    'example.ts': ("""
+interface Shape { area(): number; }
+class Square implements Shape {
+  area(): number { return 1; }
+}
+""", {'Shape': {}, 'Square': {'area': {}}}),
+    'example.go': ("""
+package main
+
+type Point struct {
+	X int
+}
+
+func (p Point) Norm() int { return p.X }
+
+func main() {}
+""", {'Point': {}, 'Norm': {}, 'main': {}}),
+    'example.rs': ("""
+struct Point { x: i32 }
+
+impl Point {
+    fn norm(&self) -> i32 { self.x }
+}
+
+trait Shape { fn area(&self) -> f64; }
+""", {'Point': {}, 'Point2': {'norm': {}}, 'Shape': {}}),
+    'example.java': ("""
+public class Main {
+    public Main() {}
+    public static void main(String[] args) {}
+}
+""", {'Main': {'Main': {}, 'main': {}}}),
+    'example.c': ("""
+struct point { int x; };
+
+int *make(void) { return 0; }
+int main(void) { return 0; }
+""", {'point': {}, 'make': {}, 'main': {}}),
+}
+
+def definition_names(ast):
+    return {name: definition_names(child) for (name, child) in ast.children.items() if child.signature != ''}
+
+@pytest.mark.parametrize("filename", [*samples.keys()])
+def test_languages(filename):
+    code, expected = samples[filename]
+    ast = treesitter_ast_with_other_code_blocks(code, language=language_for_path(filename))
+    assert definition_names(ast) == expected
+
+def test_all_queries_compile():
+    for language in queries:
+        query_for(language)
+
+def test_unknown_language():
+    assert language_for_path('notes.txt') is None
+    ast = treesitter_parse("def f():\n    pass\n", None)
+    assert ast.source.tree is None
+    assert [*ast.children.keys()] == ['%code_block_1']
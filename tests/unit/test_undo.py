@@ -0,0 +1,61 @@
+import hashlib
+
+from strange_loop_agent.undo import UndoJournal
+
+def test_undo_and_redo_across_restarts(tmp_path):
+    hash_dir = tmp_path / '.agent'
+    hash_dir.mkdir()
+    path = tmp_path / 'a.py'
+    new_path = tmp_path / 'b.py'
+
+    journal = UndoJournal(hash_dir)
+    path.write_text('x = 1\n')
+    journal.record([(path, None, 'x = 1\n')])
+    path.write_text('x = 2\n')
+    new_path.write_text('y = 1\n')
+    step = journal.record([(path, 'x = 1\n', 'x = 2\n'), (new_path, None, 'y = 1\n')])
+
+    #A new journal (e.g. after a restart) reads the steps back from the hash directory.
+    journal = UndoJournal(hash_dir)
+    assert journal.undo() == step
+    assert path.read_text() == 'x = 1\n'
+    assert not new_path.exists()
+
+    journal = UndoJournal(hash_dir)
+    assert journal.redo() == step
+    assert path.read_text() == 'x = 2\n'
+    assert new_path.read_text() == 'y = 1\n'
+    assert journal.redo() is None
+
+def test_blobs_are_deduplicated_and_collected(tmp_path):
+    path = tmp_path / 'a.py'
+    journal = UndoJournal(tmp_path)
+    for i in range(10):
+        journal.record([(path, 'a' * 10000, 'b' * 10000)])
+    assert len([*journal.blobs.dir.glob('*/*')]) == 2
+
+    #Writing something new after an undo drops the redo step, and its blobs.
+    path.write_text('c')
+    journal.record([(path, 'b' * 10000, 'c')])
+    journal.undo()
+    journal.record([(path, 'b' * 10000, 'd')])
+    journal.gc()
+    assert not journal.blobs.blob_path(hashlib.sha256(b'c').hexdigest()).exists()
+    assert journal.blobs.blob_path(hashlib.sha256(b'd').hexdigest()).exists()
+
+def test_conflicts_with_edits_since(tmp_path):
+    path = tmp_path / 'a.py'
+    journal = UndoJournal(tmp_path)
+    path.write_text('x = 1\n')
+    journal.record([(path, None, 'x = 1\n')])
+    path.write_text('x = 2\n')
+    journal.record([(path, 'x = 1\n', 'x = 2\n')])
+    assert journal.undo_conflicts() == []
+
+    path.write_text('x = 3\n')
+    assert journal.undo_conflicts() == [str(path)]
+
+    path.write_text('x = 2\n')
+    journal.undo()
+    path.unlink()
+    assert journal.redo_conflicts() == [str(path)]
@@ -0,0 +1,61 @@
+import time
+import pytest
+from strange_loop_agent import summary
+from strange_loop_agent.watcher import InotifyWatcher, PollingWatcher
+from strange_loop_agent.FullPath import FullPath
+
+def inotify_or_skip():
+    try:
+        return InotifyWatcher()
+    except OSError:
+        pytest.skip("inotify not available")
+
+@pytest.fixture(params=['inotify', 'polling'])
+def watcher(request):
+    watcher = inotify_or_skip() if request.param == 'inotify' else PollingWatcher()
+    summary.set_watcher(watcher)
+    yield watcher
+    summary.set_watcher(None)
+
+def write(path, text):
+    path.write_text(text)
+    #Make sure the polling watcher sees a new mtime.
+    time.sleep(0.01)
+
+def test_watcher_reports_changes(tmp_path, watcher):
+    path = tmp_path / 'a.py'
+    path.write_text('x = 1\n')
+    watcher.watch(path)
+    seq = watcher.poll()
+    assert not watcher.changed_since(path, seq)
+
+    write(path, 'x = 2\n')
+    watcher.poll()
+    assert watcher.changed_since(path, seq)
+
+def test_only_changed_summaries_are_updated(tmp_path, watcher, monkeypatch):
+    (tmp_path / 'a.py').write_text('def f():\n    pass\n')
+    (tmp_path / 'b.py').write_text('def g():\n    pass\n')
+    summaries, _ = summary.add_summaries_from_token_sources({}, [(FullPath(tmp_path), 10000)])
+    assert len(summaries) == 3
+
+    updated = []
+    original_update = summary.CodeSummary.update
+    def update(self):
+        updated.append(self.path.path.name)
+        return original_update(self)
+    monkeypatch.setattr(summary.CodeSummary, 'update', update)
+
+    summaries, messages = summary.update_delete_summaries(summaries)
+    assert updated == [] and messages == []
+
+    write(tmp_path / 'a.py', 'def f():\n    return 1\n')
+    summaries, messages = summary.update_delete_summaries(summaries)
+    assert updated == ['a.py']
+    assert len(messages) == 1
+
+    (tmp_path / 'b.py').unlink()
+    summaries, messages = summary.update_delete_summaries(summaries)
+    assert updated == ['a.py', 'b.py']
+    assert FullPath(tmp_path / 'b.py') not in summaries
+    assert any('b.py' in message for message in messages)